@@ -0,0 +1,170 @@
+import argparse
+from collections import OrderedDict
+
+import pandas as pd
+
+from export import iter_rows
+
+CATEGORICAL_QUESTIONS = {"Q1": "Q1_selection", "Q3": "Q3_interest"}
+
+# results for the last few input fingerprints, so an unchanged disease is not recomputed
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_SIZE = 16
+
+
+def load_answers(parent_disease, dumps=None):
+    """One row per (annotator, drug) for every annotator copy of a disease.
+
+    "answered" tells drugs the annotator completed or saved answers for
+    from ones still holding the pipeline's pre-annotation.
+    """
+    frame = pd.DataFrame.from_records(
+        iter_rows(dumps, [parent_disease]),
+        columns=["annotator", "drug", "completed", "version", "Q1_selection", "Q2_selection", "Q3_interest"],
+    )
+    frame = frame[frame["annotator"].notna()]
+    frame["Q2_selection"] = frame["Q2_selection"].apply(lambda v: tuple(sorted(v or ())))
+    frame["answered"] = frame["completed"].fillna(False).astype(bool) | (frame["version"].fillna(0) > 0)
+    return frame.reset_index(drop=True)
+
+
+def fingerprint(frame):
+    return int(pd.util.hash_pandas_object(frame, index=False).sum())
+
+
+def _fleiss(counts):
+    """Per-item observed agreement and Fleiss' kappa from an items x categories count table.
+
+    Kappa is NaN when only one category occurs, since chance agreement is
+    then already perfect.
+    """
+    n = counts.sum(axis=1)
+    observed = (counts * (counts - 1)).sum(axis=1) / (n * (n - 1))
+    observed = observed.where(n > 1)
+    totals = counts.sum(axis=0)
+    expected = ((totals / totals.sum()) ** 2).sum() if totals.sum() else 1.0
+    mean_observed = observed.mean()
+    kappa = float("nan") if expected >= 1 else (mean_observed - expected) / (1 - expected)
+    return observed, float(mean_observed), float(kappa)
+
+
+def categorical_agreement(frame, column):
+    """Agreement on a single-choice question, computed for all drugs at once."""
+    answered = frame[frame[column].notna()]
+    counts = pd.crosstab(answered["drug"], answered[column])
+    per_drug, observed, kappa = _fleiss(counts)
+
+    answers = frame.pivot(index="drug", columns="annotator", values=column)
+    disagreeing = per_drug[per_drug < 1].index
+    return {
+        "observed": observed,
+        "kappa": kappa,
+        "per_drug": per_drug,
+        "disagreements": answers.loc[disagreeing],
+    }
+
+
+def multilabel_agreement(frame, column="Q2_selection"):
+    """Agreement on a multi-choice question, one yes/no question per option."""
+    exploded = frame[["drug", "annotator", column]].explode(column, ignore_index=True).dropna()
+    onehot = pd.crosstab([exploded["drug"], exploded["annotator"]], exploded[column]).clip(upper=1)
+    # annotators who picked nothing still count as "no" for every option
+    pairs = pd.MultiIndex.from_frame(frame[["drug", "annotator"]])
+    onehot = onehot.reindex(pairs, fill_value=0)
+
+    yes = onehot.groupby(level="drug").sum()
+    raters = onehot.groupby(level="drug").size()
+    no = yes.rsub(raters, axis=0)
+
+    per_option = {}
+    per_drug_option = {}
+    for option in yes.columns:
+        counts = pd.concat({"yes": yes[option], "no": no[option]}, axis=1)
+        per_drug_option[option], observed, kappa = _fleiss(counts)
+        per_option[option] = {"observed": observed, "kappa": kappa}
+
+    per_drug = pd.DataFrame(per_drug_option).mean(axis=1)
+    split = ((yes > 0) & (no > 0)).any(axis=1)
+    answers = frame.pivot(index="drug", columns="annotator", values=column)
+    return {
+        "observed": float(per_drug.mean()) if len(per_drug) else float("nan"),
+        "per_option": per_option,
+        "per_drug": per_drug,
+        "disagreements": answers.loc[split[split].index],
+    }
+
+
+def agreement_report(parent_disease, dumps=None):
+    """Agreement on Q1, Q2 and Q3 across all annotator copies of a disease.
+
+    Only drugs every annotator has answered are compared; untouched ones
+    still hold the same pipeline pre-annotation in every copy and would
+    only measure the pipeline agreeing with itself. Raises ValueError when
+    fewer than two annotators, or no drug answered by all of them, are found.
+    """
+    frame = load_answers(parent_disease, dumps)
+    annotators = sorted(frame["annotator"].unique())
+    if len(annotators) < 2:
+        found = ", ".join(annotators) or "none"
+        raise ValueError(f"{parent_disease}: agreement needs at least two annotator copies (found: {found})")
+    key = (parent_disease, fingerprint(frame.astype(str)))
+    if key in _RESULT_CACHE:
+        _RESULT_CACHE.move_to_end(key)
+        return _RESULT_CACHE[key]
+
+    answered_by_all = frame.groupby("drug")["answered"].all()
+    excluded = int((~answered_by_all).sum())
+    frame = frame[frame["drug"].isin(answered_by_all[answered_by_all].index)]
+    if frame.empty:
+        raise ValueError(f"{parent_disease}: no drug has been answered by every annotator yet "
+                         f"({excluded} drugs excluded)")
+
+    report = {
+        "disease": parent_disease,
+        "annotators": annotators,
+        "drugs": frame["drug"].nunique(),
+        "excluded": excluded,
+        "Q2": multilabel_agreement(frame),
+    }
+    for question, column in CATEGORICAL_QUESTIONS.items():
+        report[question] = categorical_agreement(frame, column)
+
+    _RESULT_CACHE[key] = report
+    if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+        _RESULT_CACHE.popitem(last=False)
+    return report
+
+
+def print_report(report, show=10):
+    print(f"{report['disease']}: {report['drugs']} drugs answered by every annotator "
+          f"({report['excluded']} excluded), annotators: {', '.join(report['annotators'])}")
+    for question in ("Q1", "Q2", "Q3"):
+        result = report[question]
+        kappa = f", kappa {result['kappa']:.3f}" if "kappa" in result else ""
+        print(f"  {question}: observed agreement {result['observed']:.3f}{kappa}, "
+              f"{len(result['disagreements'])} drugs with disagreement")
+        if show:
+            print(result["disagreements"].head(show).to_string(max_colwidth=40))
+    for option, result in report["Q2"]["per_option"].items():
+        print(f"  Q2 {option}: observed {result['observed']:.3f}, kappa {result['kappa']:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inter-annotator agreement for a disease with several annotators.")
+    parser.add_argument("disease", help="parent disease, e.g. glioblastoma")
+    parser.add_argument("--dump", action="append", dest="dumps",
+                        help="read a mongoexport dump instead of the database (repeatable)")
+    parser.add_argument("--show", type=int, default=10, help="disagreeing drugs to print per question")
+    parser.add_argument("--disagreements-csv", help="write every disagreeing drug to this CSV file")
+    args = parser.parse_args()
+
+    try:
+        report = agreement_report(args.disease, args.dumps)
+    except ValueError as exc:
+        raise SystemExit(str(exc))
+    print_report(report, args.show)
+    if args.disagreements_csv:
+        pd.concat(
+            {q: report[q]["disagreements"].astype(str) for q in ("Q1", "Q2", "Q3")},
+            names=["question", "drug"],
+        ).to_csv(args.disagreements_csv)
@@ -1,6 +1,14 @@
+import uuid
+
 import streamlit as st
-from pymongo import MongoClient
-import re
+from collections import OrderedDict
+
+import perf
+import prefetch
+from autosave import CONFLICT, FAILED, PENDING, SAVED, get_autosave
+from references import panel_md
+from registry import disease_title
+from store import load_cursor, load_drug, load_drug_index, next_pending
 
 # remove the space
 st.html("""
@@ -31,107 +39,203 @@ def scroll_to_top():
     """, height=0)
 
 def display_disease_name(d):
+    """Title from the disease registry; keys that are not listed get a readable fallback."""
+    title = disease_title(d)
+    if title:
+        return title
     d = d.lower()
     if d.endswith("cancer") and " " not in d:
         return d.replace("cancer", " cancer").title()
-    else:
-        if d.endswith("david") or d.endswith("david"):
-            disease_name, person = "Glioblastoma_David".split("_")
-            return disease_name
-    return d.title()
-
-
-def bracket_url_to_md(text):
-    if text is None:
-        return ""
-    text = str(text)
-    pattern = r"\[(https?://[^\]]+)\]"
-    repl = r"<\1>"
-    return re.sub(pattern, repl, text)
-
-def format_reference(ref):
-    if isinstance(ref, str):
-        return bracket_url_to_md(ref)
-    elif isinstance(ref, dict):
-        title = ref.get("study_summary", {}).get("title", "")
-        nct = ref.get("nct_id", "")
-        url = f"https://clinicaltrials.gov/study/{nct}" if nct else ""
-        if url:
-            return f"**{title}** — [{nct}]({url})"
-        else:
-            return f"**{title}**"
-    return ""
-
-def run_annotation(assigned_disease):
-    # hide Streamlit sidebar
-    st.markdown("""
-        <style>
-            [data-testid="stSidebarNav"] { display: none; }
-            [data-testid="stSidebar"] { background-color: white; }
-        </style>
-    """, unsafe_allow_html=True)
-
-    # confirmation of moving on to next drug 
-    if "confirm_next" not in st.session_state: 
-        st.session_state.confirm_next = False
-    # auto email (no login)
-    email = f"auto_user_{assigned_disease}"
-    st.session_state.user_email = email
-    st.session_state.assigned_disease = assigned_disease.lower().strip()
-
-    if "navigate_to" not in st.session_state:
-        st.session_state.navigate_to = None
+    return d.replace("_", " ").title()
+
+
+# reference panels stay closed until opened; rendered panels are kept per session
+LAZY_REFERENCES = st.secrets.get("LAZY_REFERENCES", True)
+SESSION_PANEL_CACHE_SIZE = 32
+
+
+def reference_panel(title, kind, disease, drug, view):
+    """Show a reference panel; view is a prefetch.get() result."""
+    def render():
+        with perf.span("references"):
+            return view["references_md"].get(kind) or panel_md(view["doc"] or {}, kind)
+
+    if not LAZY_REFERENCES:
+        with st.expander(title, expanded=True):
+            st.markdown(render())
+        return
+
+    # one toggle per panel type, so an opened panel stays open on the next drug
+    if not st.toggle(title, key=f"show_{kind}_references"):
+        return
+    cache = st.session_state.setdefault("reference_panels", OrderedDict())
+    key = (disease, drug, kind)
+    if key not in cache:
+        cache[key] = render()
+        while len(cache) > SESSION_PANEL_CACHE_SIZE:
+            cache.popitem(last=False)
+    with st.container(border=True):
+        st.markdown(cache[key])
+
+
+Q2_INTERNAL_TO_DISPLAY = {
+    "Positive result in animal study": "Positive results in animal study (live animal models)",
+    "Negative result in animal study": "Negative results in animal study (live animal models)",
+    "Positive result in vivo result": "Positive results in vivo (wet experiments at cell / tissue level)",
+    "Negative result in vivo result": "Negative results in vivo (wet experiments at cell / tissue level)",
+    "Positive result in vitro result": "Positive results in vitro result",
+    "Negative result in vitro result": "Negative results in vitro result",
+    "Rarely discussed": "Rarely discussed",
+    "Irrelevant drugs": "Irrelevant drugs",
+}
 
-    if "confirm_save" not in st.session_state:
-        st.session_state.confirm_save = False
 
-    # DB setup
-    client = MongoClient(st.secrets["MONGO_URI"])
-    db = client["kgxllm"]
-    diseases_collection = db["diseases"]
-    users_collection = db["users"]
+def widget_answers(disease, drug):
+    """Answers currently held by a drug's widgets, as stored field -> value.
+
+    Fields whose widgets are not in session state are left out.
+    """
+    state = st.session_state
+    answers = {}
+    if f"Q1_{disease}_{drug}" in state:
+        answers["Q1.selection"] = state[f"Q1_{disease}_{drug}"]
+    q2_keys = {opt: f"Q2_{disease}_{drug}_{opt}" for opt in Q2_INTERNAL_TO_DISPLAY}
+    if all(key in state for key in q2_keys.values()):
+        answers["Q2.selection"] = [opt for opt, key in q2_keys.items() if state[key]]
+    if f"Q3_{disease}_{drug}" in state:
+        answers["Q3_interest"] = state[f"Q3_{disease}_{drug}"]
+    if f"Q4_{disease}_{drug}" in state:
+        answers["Q4_notes"] = state[f"Q4_{disease}_{drug}"]
+    return answers
+
+
+def drop_widget_state(disease, drug):
+    for key in (
+        f"Q1_{disease}_{drug}",
+        f"Q3_{disease}_{drug}",
+        f"Q4_{disease}_{drug}",
+        *(f"Q2_{disease}_{drug}_{opt}" for opt in Q2_INTERNAL_TO_DISPLAY),
+    ):
+        st.session_state.pop(key, None)
+
+
+def session_owner():
+    """Token that tells this browser session's writes apart from other tabs'."""
+    return st.session_state.setdefault("session_owner", uuid.uuid4().hex)
+
+
+def leave_drug(autosave, disease, drug):
+    """Keep widget state for the drug on screen only.
+
+    When the annotator moves on without pressing Next (sidebar, Back,
+    another page), whatever differs from the answers the drug was opened
+    with is queued through autosave before its widget keys are dropped, so
+    nothing typed is lost and state does not pile up per visited drug.
+    """
+    editing = st.session_state.get("editing")
+    if editing and (editing["disease"], editing["drug"]) != (disease, drug):
+        answers = widget_answers(editing["disease"], editing["drug"])
+        changed = {
+            field: value for field, value in answers.items()
+            if value != editing["answers"].get(field)
+        }
+        if changed:
+            autosave.submit(editing["disease"], editing["drug"], changed, editing["version"], session_owner())
+            prefetch.invalidate(editing["disease"], editing["drug"])
+        drop_widget_state(editing["disease"], editing["drug"])
+        editing = None
+    return editing
+
+
+def conflict_panel(autosave, disease, current_drug, owner):
+    """Let the annotator settle answers that another session overwrote first."""
+    for drug, fields in autosave.conflicts(disease, owner).items():
+        st.warning(
+            f"**{drug}** was changed in another session before your answers were saved, "
+            f"so yours were not written ({', '.join(sorted(fields))})."
+        )
+        keep_col, load_col = st.columns(2)
+        if keep_col.button("Keep my answers", key=f"conflict_keep_{drug}", use_container_width=True):
+            stored = load_drug(disease, drug) or {}
+            autosave.resolve(disease, drug, owner, keep_mine=True, version=stored.get("version", 0))
+            prefetch.invalidate(disease, drug)
+            st.rerun()
+        if load_col.button("Load saved answers", key=f"conflict_load_{drug}", use_container_width=True):
+            autosave.resolve(disease, drug, owner, keep_mine=False)
+            prefetch.invalidate(disease, drug)
+            if drug == current_drug:
+                # re-render the widgets from the stored document
+                drop_widget_state(disease, drug)
+                st.session_state.editing = None
+            st.rerun()
 
-    doc = diseases_collection.find_one({"disease": assigned_disease})
-    if not doc:
-        st.error(f"Disease '{assigned_disease}' not found.")
-        st.stop()
 
-    drug_map = doc["drug_map"]
-    updates_needed = {}
-    for drug, data in drug_map.items():
-        if "completed" not in data:
-            updates_needed[f"drug_map.{drug}.completed"] = False
+def next_unfinished(disease, drug_index, completed_by_drug, after=None):
+    """First drug after `after` (wrapping around) that is not complete, or None.
 
-    if updates_needed:
-        diseases_collection.update_one(
-            {"disease": assigned_disease},
-            {"$set": updates_needed}
-        )
-        doc = diseases_collection.find_one({"disease": assigned_disease})
-        drug_map = doc["drug_map"]
+    The database answers from its pending-drugs index; completions still
+    queued in autosave are skipped here, which costs one more lookup each.
+    """
+    orders = {entry["drug"]: entry.get("order", -1) for entry in drug_index}
+    after_order = orders.get(after, -1)
+    seen = set()
+    while True:
+        found = next_pending(disease, after_order)
+        if found is None or found["drug"] in seen:
+            return None
+        if not completed_by_drug.get(found["drug"], False):
+            return found["drug"]
+        seen.add(found["drug"])
+        after_order = found["order"]
 
-    def is_completed(drug):
-           return drug_map[drug].get("completed", False)
 
-    # pick next drug
-    def get_next_drug():
-        for drug in drug_map.keys():
-            if not is_completed(drug):
-                return drug
-        return None
+SIDEBAR_PAGE_SIZE = 25
+SIDEBAR_FILTERS = ["All", "Pending", "Completed"]
 
-    # navigation
-    current_drug = st.session_state.navigate_to or get_next_drug()
 
-    if current_drug is None:
-        st.success("🎉 All drugs annotated!")
-        st.stop()
+def drug_sidebar(drug_index, completed_by_drug, current_drug):
+    """Searchable, filterable drug list that renders one page of buttons at a time.
 
-    drug_list = list(drug_map.keys())
+    drug_index is load_drug_index() output; only SIDEBAR_PAGE_SIZE drugs
+    become widgets however long the list is.
+    """
     st.sidebar.title("Drugs")
+    query = st.sidebar.text_input("Search", key="sidebar_search", placeholder="Drug name").strip().lower()
+    statuses = sorted({entry.get("Q1", {}).get("selection") for entry in drug_index} - {None})
+    show = st.sidebar.selectbox(
+        "Show",
+        SIDEBAR_FILTERS + [f"Q1: {status}" for status in statuses],
+        key="sidebar_filter",
+    )
+
+    matches = []
+    for entry in drug_index:
+        drug = entry["drug"]
+        done = completed_by_drug[drug]
+        if query and query not in drug.lower():
+            continue
+        if show == "Pending" and done:
+            continue
+        if show == "Completed" and not done:
+            continue
+        if show.startswith("Q1: ") and entry.get("Q1", {}).get("selection") != show[4:]:
+            continue
+        matches.append(drug)
+
+    page_count = max(1, -(-len(matches) // SIDEBAR_PAGE_SIZE))
+    # jump to the current drug's page whenever the current drug or the list changes
+    view_key = (current_drug, query, show)
+    if st.session_state.get("sidebar_view") != view_key:
+        st.session_state.sidebar_view = view_key
+        st.session_state.sidebar_page = (
+            matches.index(current_drug) // SIDEBAR_PAGE_SIZE if current_drug in matches else 0
+        )
+    page = min(st.session_state.sidebar_page, page_count - 1)
+    start = page * SIDEBAR_PAGE_SIZE
+    window = matches[start:start + SIDEBAR_PAGE_SIZE]
 
-    for drug in drug_list:
-        done = is_completed(drug)
+    for drug in window:
+        done = completed_by_drug[drug]
 
         # highlight active drug
         if drug == current_drug:
@@ -155,15 +259,127 @@ def run_annotation(assigned_disease):
                 st.session_state.navigate_to = drug
                 st.session_state.last_drug = drug
                 st.rerun()
+
+    if not matches:
+        st.sidebar.caption("No drugs match.")
+        return
+    st.sidebar.caption(f"{start + 1}–{start + len(window)} of {len(matches)}")
+    if page_count > 1:
+        prev_col, next_col = st.sidebar.columns(2)
+        if prev_col.button("‹ Prev", key="sidebar_prev", disabled=page == 0, use_container_width=True):
+            st.session_state.sidebar_page = page - 1
+            st.rerun()
+        if next_col.button("Next ›", key="sidebar_next", disabled=page >= page_count - 1, use_container_width=True):
+            st.session_state.sidebar_page = page + 1
+            st.rerun()
+
+
+def run_annotation(assigned_disease):
+    page = f"annotation/{assigned_disease}"
+    # shows the previous rerun; this one is still being timed
+    perf.debug_panel(page)
+    with perf.rerun(page):
+        annotation_page(assigned_disease)
+
+
+def annotation_page(assigned_disease):
+    # hide Streamlit sidebar
+    st.markdown("""
+        <style>
+            [data-testid="stSidebarNav"] { display: none; }
+            [data-testid="stSidebar"] { background-color: white; }
+        </style>
+    """, unsafe_allow_html=True)
+
+    # confirmation of moving on to next drug 
+    if "confirm_next" not in st.session_state: 
+        st.session_state.confirm_next = False
+    # auto email (no login)
+    email = f"auto_user_{assigned_disease}"
+    st.session_state.user_email = email
+    # every disease is served by the same page, so a drug picked on another one must not carry over
+    if st.session_state.get("assigned_disease") != assigned_disease.lower().strip():
+        st.session_state.navigate_to = None
+    st.session_state.assigned_disease = assigned_disease.lower().strip()
+
+    if "navigate_to" not in st.session_state:
+        st.session_state.navigate_to = None
+
+    if "confirm_save" not in st.session_state:
+        st.session_state.confirm_save = False
+
+    # names + completed flags only; the current drug is fetched on its own below
+    with perf.span("drug_index"):
+        drug_index = load_drug_index(assigned_disease)
+    if not drug_index:
+        st.error(f"Disease '{assigned_disease}' not found.")
+        st.stop()
+
+    completed_by_drug = {entry["drug"]: entry.get("completed", False) for entry in drug_index}
+
+    # answers are written behind the click; show what is still queued
+    autosave = get_autosave()
+    for drug, fields in autosave.pending_for_disease(assigned_disease).items():
+        if "completed" in fields and drug in completed_by_drug:
+            completed_by_drug[drug] = fields["completed"]
+
+    # navigation; the drug picked here stays open until the annotator moves on
+    if st.session_state.navigate_to is None:
+        cursor = None
+        if st.session_state.get("resumed") != assigned_disease:
+            # once per session and disease: back to where this annotator left off
+            st.session_state.resumed = assigned_disease
+            cursor = load_cursor(assigned_disease, email)
+        if cursor in completed_by_drug and not completed_by_drug[cursor]:
+            st.session_state.navigate_to = cursor
+        else:
+            st.session_state.navigate_to = next_unfinished(assigned_disease, drug_index, completed_by_drug, cursor)
+    current_drug = st.session_state.navigate_to
+
+    editing = leave_drug(autosave, assigned_disease, current_drug)
+
+    if current_drug is None:
+        st.success("🎉 All drugs annotated!")
+        st.stop()
+
+    drug_list = list(completed_by_drug)
+    position = {drug: i for i, drug in enumerate(drug_list)}
+    with perf.span("sidebar"):
+        drug_sidebar(drug_index, completed_by_drug, current_drug)
     disease_title = display_disease_name(assigned_disease)
     st.title(f"{disease_title} — Drug Annotation")
-    drug_list = list(drug_map.keys())
     total_drugs = len(drug_list)
-    completed_count = sum(1 for drug in drug_list if is_completed(drug))
+    completed_count = sum(1 for done in completed_by_drug.values() if done)
     st.markdown(f"### Progress: {completed_count}/{total_drugs} completed")
     st.progress(completed_count / total_drugs)
     st.header(f"Drug: **{current_drug}**")
-    questionnaire = drug_map[current_drug]
+    with perf.span("load_drug"):
+        drug_view = prefetch.get(assigned_disease, current_drug)
+    # load what "Next →" and "← Back" lead to while the annotator works here
+    idx = position[current_drug]
+    prefetch.schedule(assigned_disease, [
+        drug_list[idx + 1] if idx + 1 < len(drug_list) else None,
+        drug_list[idx - 1] if idx > 0 else None,
+    ])
+    questionnaire = autosave.overlay(
+        assigned_disease,
+        current_drug,
+        drug_view["doc"] or {}
+    )
+    owner = session_owner()
+    conflict_panel(autosave, assigned_disease, current_drug, owner)
+    save_status = autosave.status(assigned_disease, current_drug, owner)
+    if save_status == SAVED:
+        st.caption("✅ All changes saved")
+    elif save_status == PENDING:
+        st.caption("⏳ Saving…")
+    elif save_status == CONFLICT:
+        st.caption("⚠️ Not saved — this drug was changed in another session")
+    elif save_status == FAILED:
+        error = autosave.failures(assigned_disease, owner).get(current_drug)
+        st.caption(f"❌ Not saved — the database refused this change ({error}); editing it again retries")
+    else:
+        st.caption("⚠️ Database unreachable — changes are kept locally and will be retried")
     prev_Q1 = (
     questionnaire["Q1"]["selection"]
     if "Q1" in questionnaire and isinstance(questionnaire["Q1"], dict)
@@ -202,28 +418,9 @@ def run_annotation(assigned_disease):
         index=Q1_options.index(prev_Q1) if prev_Q1 in Q1_options else None, 
         key=f"Q1_{assigned_disease}_{current_drug}"
     )
-    clinical_refs = []
-    if "Q1" in questionnaire and isinstance(questionnaire["Q1"], dict):
-        clinical_refs = questionnaire["Q1"].get("clinicaltrial_references", [])
+    reference_panel("Clinical Trials", "clinicaltrial", assigned_disease, current_drug, drug_view)
 
-    if clinical_refs:
-        refs_md = "\n".join(f"- {format_reference(ref)}" for ref in clinical_refs)
-    else:
-        refs_md = "No clinical trial references found."
-
-    with st.expander("Clinical Trials", expanded=True):
-        st.markdown(refs_md)
-
-    Q2_internal_to_display = {
-        "Positive result in animal study": "Positive results in animal study (live animal models)",
-        "Negative result in animal study": "Negative results in animal study (live animal models)",
-        "Positive result in vivo result": "Positive results in vivo (wet experiments at cell / tissue level)",
-        "Negative result in vivo result": "Negative results in vivo (wet experiments at cell / tissue level)",
-        "Positive result in vitro result": "Positive results in vitro result",
-        "Negative result in vitro result": "Negative results in vitro result",
-        "Rarely discussed": "Rarely discussed",
-        "Irrelevant drugs": "Irrelevant drugs",
-    }
+    Q2_internal_to_display = Q2_INTERNAL_TO_DISPLAY
 
     Q2_display_to_internal = {v: k for k, v in Q2_internal_to_display.items()}
     Q2_display_options = list(Q2_display_to_internal.keys())
@@ -249,17 +446,7 @@ def run_annotation(assigned_disease):
         if checked:
             Q2_value_internal.append(internal_opt)
 
-    literature_refs = []
-    if "Q2" in questionnaire and isinstance(questionnaire["Q2"], dict):
-        literature_refs = questionnaire["Q2"].get("literature_references", [])
-
-    if literature_refs:
-        refs_md = "\n".join(f"- {bracket_url_to_md(ref)}" for ref in literature_refs)
-    else:
-        refs_md = "No literature references found."
-
-    with st.expander("Literature References", expanded=True):
-        st.markdown(refs_md)
+    reference_panel("Literature References", "literature", assigned_disease, current_drug, drug_view)
 
     prev_Q3 = questionnaire.get("Q3_interest")
     st.html("""
@@ -290,40 +477,48 @@ def run_annotation(assigned_disease):
     height=200,
     key=f"Q4_{assigned_disease}_{current_drug}"
     )
-    def save_answers():
-        st.session_state.confirm_save = False
-        new_data = {
-            "Q1.selection": Q1_value,
-            "Q2.selection": Q2_value_internal,
-            "Q3_interest": Q3_value,
-            "Q4_notes": Q4_value,
-        }
 
-        updates = {
-            f"drug_map.{current_drug}.{key}": val
-            for key, val in new_data.items()
-            if val != questionnaire.get(key, None)
+    # the first render shows the stored answers; later edits are diffed against them
+    if editing is None:
+        autosave.save_cursor(assigned_disease, email, current_drug)
+        editing = st.session_state.editing = {
+            "disease": assigned_disease,
+            "drug": current_drug,
+            "answers": widget_answers(assigned_disease, current_drug),
+            "version": questionnaire.get("version", 0),
         }
 
-        if updates:
-            diseases_collection.update_one(
-                {"disease": assigned_disease},
-                {"$set": updates}
-            )
+    def save_answers():
+        with perf.span("save_answers"):
+            st.session_state.confirm_save = False
+            new_data = {
+                "Q1.selection": Q1_value,
+                "Q2.selection": Q2_value_internal,
+                "Q3_interest": Q3_value,
+                "Q4_notes": Q4_value,
+            }
+
+            # only what differs from the answers last saved from this screen
+            updates = {
+                key: val
+                for key, val in new_data.items()
+                if val != editing["answers"].get(key)
+            }
+            if updates:
+                autosave.submit(assigned_disease, current_drug, updates, editing["version"], owner)
+                prefetch.invalidate(assigned_disease, current_drug)
+                editing["answers"].update(updates)
 
     def save_and_mark_completed():
         save_answers()
-        diseases_collection.update_one(
-            {"disease": assigned_disease},
-            {"$set": {f"drug_map.{current_drug}.completed": True}}
-        )
+        if not completed_by_drug[current_drug]:
+            autosave.submit(assigned_disease, current_drug, {"completed": True}, editing["version"], owner)
+            prefetch.invalidate(assigned_disease, current_drug)
 
     st.markdown("<div style='margin-top: 2rem;'></div>", unsafe_allow_html=True)
     col1, col2, col3 = st.columns([1, 1, 1])
 
     with col1:
-        drug_list = list(drug_map.keys())
-        idx = drug_list.index(current_drug)
         back_disabled = idx == 0
         if st.button("← Back", use_container_width=True, disabled=back_disabled):
             prev_drug = drug_list[idx - 1]
@@ -339,8 +534,6 @@ def run_annotation(assigned_disease):
         if st.button("Next →", use_container_width=True):
 
             save_answers()
-            drug_list = list(drug_map.keys())
-            idx = drug_list.index(current_drug)
 
             if idx < len(drug_list) - 1:
                 next_drug = drug_list[idx + 1]
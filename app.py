@@ -1,4 +1,29 @@
 import streamlit as st
 
-# directly direct them to the annotation
-st.switch_page("pages/annotation.py")
\ No newline at end of file
+from annotation_shared import display_disease_name, run_annotation
+from registry import get_registry
+from store import warm_up
+
+# open the storage backend before the first page needs it
+warm_up()
+
+# every disease and annotator copy in diseases.toml is served here,
+# e.g. /?disease=melanoma or /?disease=glioblastoma_betty
+registry = get_registry()
+disease = st.query_params.get("disease", "").strip().lower()
+
+if disease in registry:
+    run_annotation(disease)
+    st.stop()
+
+if disease:
+    st.error(f"Disease '{disease}' is not in the registry.")
+
+st.title("Drug Annotation")
+for key, entry in registry.items():
+    label = display_disease_name(key)
+    if entry["annotator"]:
+        label = f"{label} ({entry['annotator'].title()})"
+    if st.button(label, key=f"open_{key}"):
+        st.query_params["disease"] = key
+        st.rerun()
@@ -0,0 +1,371 @@
+import atexit
+import json
+import logging
+import os
+import threading
+
+import streamlit as st
+
+from store import bulk_set_drug_fields, is_transient_error, save_cursor, set_dotted
+
+AUTOSAVE_DEFAULTS = {
+    "AUTOSAVE_DIR": ".autosave",
+    "AUTOSAVE_FLUSH_INTERVAL_S": 0.5,
+    "AUTOSAVE_MAX_BACKOFF_S": 30,
+}
+
+SAVED = "saved"
+PENDING = "pending"
+RETRYING = "retrying"
+CONFLICT = "conflict"
+FAILED = "failed"
+
+# owner of conflicts and failures whose session did not survive a restart;
+# each disease copy has one annotator, so whoever opens it next settles them
+RESTORED_OWNER = "restored"
+
+logger = logging.getLogger("kgxllm.autosave")
+
+
+class AutosaveQueue:
+    """Write-behind queue for answer fields, backed by a local journal.
+
+    submit() appends the change to an fsynced JSONL journal and returns; a
+    daemon thread merges pending changes per drug and session (owner) and
+    writes them with one bulk_write. Each change carries the drug version
+    the session based it on; a write that finds the drug changed by another
+    session is set aside as a conflict for that session to resolve instead
+    of overwriting. Writes by the same owner always pass the check, so
+    replaying the journal after a crash or retrying a failed batch is
+    idempotent. Only transient errors (database unreachable, busy, timed
+    out) retry the batch; a change the database rejects outright is parked
+    as failed, so it cannot hold up everyone else's saves. After every
+    written batch the journal is rewritten with only what is still pending,
+    so it stays small under steady traffic. Conflicts and failures stay
+    in the journal too until they are settled; after a restart they are
+    offered to the next session that opens the disease.
+
+    Resume cursors ride along: save_cursor() keeps the latest drug per
+    (disease, annotator) and the same thread writes it after the answers,
+    without journaling, since losing one only resumes at an earlier drug.
+    """
+
+    def __init__(self, directory, flush_interval=0.5, max_backoff=30, writer=bulk_set_drug_fields,
+                 transient=is_transient_error, cursor_writer=save_cursor):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "journal.jsonl")
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.writer = writer
+        self.transient = transient
+        self.cursor_writer = cursor_writer
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._drained = threading.Condition(self._lock)
+        # (disease, drug, owner) -> {"seq": last change, "fields": merged fields, "version": base}
+        self._pending = {}
+        # (disease, drug, owner) -> {"fields": rejected fields, "version": base}
+        self._conflicts = {}
+        # (disease, drug, owner) -> {"fields": unwritable fields, "version": base, "error": message}
+        self._failed = {}
+        # (disease, email) -> drug to resume at
+        self._cursors = {}
+        # owners whose changes came from the journal, i.e. sessions from before a restart
+        self._restored_owners = set()
+        self._seq = 0
+        self.last_error = None
+
+        self._replay()
+        self._journal = open(self.path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush, 5)
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn last line from a crash mid-append
+                    continue
+                state = entry.get("state")
+                if state in (CONFLICT, FAILED):
+                    parked = self._conflicts if state == CONFLICT else self._failed
+                    slot = parked.setdefault((entry["disease"], entry["drug"], RESTORED_OWNER),
+                                             {"fields": {}, "version": entry.get("version")})
+                    slot["fields"].update(entry["fields"])
+                    if state == FAILED:
+                        slot["error"] = entry.get("error", "")
+                    continue
+                self._restored_owners.add(entry.get("owner"))
+                self._merge(entry["disease"], entry["drug"], entry["fields"],
+                            entry.get("version"), entry.get("owner"))
+
+    def _parked_key(self, parked, disease, drug, owner):
+        """The session's own key in _conflicts or _failed, else a restored one for the drug; None if neither."""
+        for key in ((disease, drug, owner), (disease, drug, RESTORED_OWNER)):
+            if key in parked:
+                return key
+        return None
+
+    def _settled_key(self, key):
+        # a session from before the restart cannot settle anything any more
+        disease, drug, owner = key
+        return (disease, drug, RESTORED_OWNER) if owner in self._restored_owners else key
+
+    def _merge(self, disease, drug, fields, version, owner):
+        self._seq += 1
+        key = (disease, drug, owner)
+        # a new edit of a drug whose last change failed tries again with both
+        failed_key = self._parked_key(self._failed, disease, drug, owner)
+        failed = self._failed.pop(failed_key) if failed_key else None
+        if failed and key not in self._pending:
+            self._pending[key] = {"seq": 0, "fields": failed["fields"], "version": failed["version"]}
+        # later changes of a session share the version its first one was based on
+        entry = self._pending.setdefault(key, {"seq": 0, "fields": {}, "version": version})
+        entry["seq"] = self._seq
+        entry["fields"].update(fields)
+
+    def submit(self, disease, drug, fields, version=None, owner=None):
+        """Durably record a change and hand it to the background writer.
+
+        version is the drug version the change was made against; None
+        writes without a check.
+        """
+        if not fields:
+            return
+        line = json.dumps(
+            {"disease": disease, "drug": drug, "fields": fields, "version": version, "owner": owner},
+            ensure_ascii=False
+        )
+        with self._lock:
+            self._journal.write(line + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._merge(disease, drug, fields, version, owner)
+        self._wake.set()
+
+    def save_cursor(self, disease, email, drug):
+        """Remember the drug an annotator has open, written in the background."""
+        with self._lock:
+            self._cursors[(disease, email)] = drug
+        self._wake.set()
+
+    def _pending_by_drug(self, disease):
+        merged = {}
+        for (entry_disease, drug, _), entry in sorted(self._pending.items(), key=lambda item: item[1]["seq"]):
+            if entry_disease == disease:
+                merged.setdefault(drug, {}).update(entry["fields"])
+        return merged
+
+    def pending_fields(self, disease, drug):
+        """Changes for one drug that are not in the database yet, from every session."""
+        with self._lock:
+            return self._pending_by_drug(disease).get(drug, {})
+
+    def pending_for_disease(self, disease):
+        """{drug: pending fields} for every drug of a disease with changes queued."""
+        with self._lock:
+            return self._pending_by_drug(disease)
+
+    def overlay(self, disease, drug, doc):
+        """Apply pending changes on top of a document read from the database."""
+        for key, value in self.pending_fields(disease, drug).items():
+            set_dotted(doc, key, value)
+        return doc
+
+    def status(self, disease, drug, owner=None):
+        """Where one session's changes to a drug stand."""
+        with self._lock:
+            if self._parked_key(self._conflicts, disease, drug, owner):
+                return CONFLICT
+            if self._parked_key(self._failed, disease, drug, owner):
+                return FAILED
+            if (disease, drug, owner) not in self._pending:
+                return SAVED
+            return RETRYING if self.last_error else PENDING
+
+    def conflicts(self, disease, owner):
+        """{drug: rejected fields} for a session's writes that lost to another session.
+
+        Includes conflicts restored from the journal after a restart.
+        """
+        with self._lock:
+            return {
+                drug: dict(entry["fields"])
+                for (entry_disease, drug, entry_owner), entry in self._conflicts.items()
+                if entry_disease == disease and entry_owner in (owner, RESTORED_OWNER)
+            }
+
+    def failures(self, disease, owner):
+        """{drug: error message} for a session's changes the database refused to write."""
+        with self._lock:
+            return {
+                drug: entry["error"]
+                for (entry_disease, drug, entry_owner), entry in self._failed.items()
+                if entry_disease == disease and entry_owner in (owner, RESTORED_OWNER)
+            }
+
+    def resolve(self, disease, drug, owner, keep_mine, version=None):
+        """Settle a conflict: write the session's fields over version, or drop them."""
+        with self._lock:
+            key = self._parked_key(self._conflicts, disease, drug, owner)
+            entry = self._conflicts.pop(key) if key else None
+            if entry:
+                self._compact()
+        if entry and keep_mine:
+            self.submit(disease, drug, entry["fields"], version, owner)
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far is written (or timeout)."""
+        self._wake.set()
+        with self._drained:
+            return self._drained.wait_for(lambda: not self._pending and not self._cursors, timeout)
+
+    def _write(self, batch):
+        """Write a batch; returns (rejected keys, {key: error} for changes that cannot be written).
+
+        Transient errors are raised, to retry the whole batch later. Any
+        other error makes each change be written on its own, to find the
+        ones the database refuses; rewriting the changes that did land is
+        harmless, since the same owner always passes the version check.
+        """
+        try:
+            return set(self.writer([
+                (disease, drug, fields, version, owner)
+                for (disease, drug, owner), (_, fields, version) in batch.items()
+            ])), {}
+        except Exception as exc:
+            if self.transient(exc):
+                raise
+            if len(batch) == 1:
+                return set(), {key: exc for key in batch}
+        rejected, failed = set(), {}
+        for key, change in batch.items():
+            one_rejected, one_failed = self._write({key: change})
+            rejected |= one_rejected
+            failed.update(one_failed)
+        return rejected, failed
+
+    def _write_cursors(self, cursors):
+        """Write resume cursors; transient errors are raised, to retry later."""
+        for key, drug in cursors.items():
+            try:
+                self.cursor_writer(*key, drug)
+            except Exception as exc:
+                if self.transient(exc):
+                    raise
+                logger.warning("could not save the cursor of %s / %s: %s", key[0], key[1], exc)
+            with self._lock:
+                # keep a newer cursor saved while this one was written
+                if self._cursors.get(key) == drug:
+                    del self._cursors[key]
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            with self._lock:
+                batch = {
+                    key: (entry["seq"], dict(entry["fields"]), entry["version"])
+                    for key, entry in self._pending.items()
+                }
+                cursors = dict(self._cursors)
+
+            if batch:
+                try:
+                    rejected, failed = self._write(batch)
+                except Exception as exc:
+                    self.last_error = exc
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+
+                self.last_error = None
+                backoff = self.flush_interval
+                with self._lock:
+                    for key, (seq, _, _) in batch.items():
+                        if key in failed:
+                            # parked with everything merged in meanwhile; the next edit retries it
+                            entry = self._pending.pop(key)
+                            error = f"{type(failed[key]).__name__}: {failed[key]}"
+                            logger.error("could not save %s / %s: %s; fields %s", key[0], key[1], error,
+                                         json.dumps(entry["fields"], ensure_ascii=False, default=str))
+                            parked = self._failed.setdefault(self._settled_key(key),
+                                                             {"fields": {}, "version": entry["version"]})
+                            parked["fields"].update(entry["fields"])
+                            parked["error"] = error
+                        elif key in rejected:
+                            # changes merged in meanwhile share the stale version, so they go too;
+                            # completion is never rejected, so a newer one stays queued
+                            entry = self._pending.pop(key)
+                            completed = entry["fields"].pop("completed", None)
+                            if entry["seq"] != seq and completed is not None:
+                                self._pending[key] = {**entry, "fields": {"completed": completed}}
+                            logger.warning("%s / %s was changed in another session; kept the rejected fields %s",
+                                           key[0], key[1],
+                                           json.dumps(entry["fields"], ensure_ascii=False, default=str))
+                            conflict = self._conflicts.setdefault(self._settled_key(key),
+                                                                  {"fields": {}, "version": entry["version"]})
+                            conflict["fields"].update(entry["fields"])
+                        # keep drugs that changed again while we were writing
+                        elif self._pending.get(key, {}).get("seq") == seq:
+                            del self._pending[key]
+                    self._compact()
+
+            if cursors:
+                try:
+                    self._write_cursors(cursors)
+                except Exception:
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+            with self._lock:
+                if not self._pending and not self._cursors:
+                    self._drained.notify_all()
+
+    def _compact(self):
+        """Rewrite the journal with what is still unsettled; called with _lock held.
+
+        One line per conflict, failure and pending change, written to a
+        temporary file and swapped in, so a crash leaves either the old
+        journal or the new one.
+        """
+        if not (self._pending or self._conflicts or self._failed):
+            self._journal.truncate(0)
+            self._journal.seek(0)
+            return
+        lines = []
+        for state, parked in ((CONFLICT, self._conflicts), (FAILED, self._failed)):
+            for (disease, drug, owner), entry in parked.items():
+                line = {"disease": disease, "drug": drug, "fields": entry["fields"],
+                        "version": entry["version"], "owner": owner, "state": state}
+                if state == FAILED:
+                    line["error"] = entry["error"]
+                lines.append(line)
+        for (disease, drug, owner), entry in sorted(self._pending.items(), key=lambda item: item[1]["seq"]):
+            lines.append({"disease": disease, "drug": drug, "fields": entry["fields"],
+                          "version": entry["version"], "owner": owner})
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            for line in lines:
+                file.write(json.dumps(line, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._journal.close()
+        os.replace(temporary, self.path)
+        self._journal = open(self.path, "a", encoding="utf-8")
+
+
+@st.cache_resource(show_spinner=False)
+def get_autosave():
+    """Process-wide autosave queue shared by every session."""
+    conf = {key: st.secrets.get(key, default) for key, default in AUTOSAVE_DEFAULTS.items()}
+    return AutosaveQueue(
+        conf["AUTOSAVE_DIR"],
+        flush_interval=float(conf["AUTOSAVE_FLUSH_INTERVAL_S"]),
+        max_backoff=float(conf["AUTOSAVE_MAX_BACKOFF_S"]),
+    )
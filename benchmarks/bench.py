@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import wait
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import create_copies
+import perf
+import upload_jsonl
+from autosave import get_autosave
+from benchmarks.synthetic import make_disease, use_mongomock, use_sqlite
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# mongomock checks unique indexes by scanning the collection, so ingest
+# gets quadratic and 10k drugs takes hours there; sqlite covers that scale
+SCALES = {
+    "mongo": [60, 1000],
+    "sqlite": [60, 1000, 10000],
+}
+
+PAGE_SCRIPT = """
+from annotation_shared import run_annotation
+run_annotation({disease!r})
+"""
+
+
+def settle(at):
+    """Wait for the background work an interaction started (autosave, prefetch)."""
+    get_autosave().flush(30)
+    cache = at.session_state["prefetch_cache"] if "prefetch_cache" in at.session_state else {}
+    wait([future for _, future in cache.values()], timeout=30)
+
+
+def bench_ingest(disease, source_dir, trips):
+    """Throughput of a first upload, an annotator copy and an unchanged re-upload."""
+    results = {}
+    for name, run in (
+        ("ingest", lambda: upload_jsonl.upload_disease(disease, source_dir)),
+        ("copy", lambda: create_copies.upload_disease_for_annotator(disease, "bench", source_dir)),
+        ("reingest", lambda: upload_jsonl.upload_disease(disease, source_dir)),
+    ):
+        if trips:
+            trips.reset()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = run()
+        seconds = time.perf_counter() - started
+        results[f"{name}_drugs_per_s"] = report["drugs"] / seconds
+        if trips:
+            results[f"{name}_round_trips"] = trips.count
+    return results
+
+
+def page_session(disease, steps, autosave_dir):
+    """An AppTest of the page and the interactions of one annotation session."""
+    at = AppTest.from_string(PAGE_SCRIPT.format(disease=disease), default_timeout=120)
+    at.secrets["MONGO_URI"] = "mongodb://benchmark"
+    at.secrets["AUTOSAVE_DIR"] = autosave_dir
+    at.secrets["PERF_ENABLED"] = True
+
+    def click(label):
+        return lambda: next(b for b in at.button if b.label.startswith(label)).click()
+
+    def toggle():
+        box = at.checkbox[0]
+        box.set_value(not box.value)
+
+    def type_notes(i):
+        return lambda: at.text_area[0].set_value(f"benchmark note {i}")
+
+    interactions = [("open", lambda: None)]
+    for i in range(steps):
+        interactions += [("toggle", toggle), ("type", type_notes(i)), ("next", click("Next"))]
+    interactions.append(("confirm", click("Confirm")))
+    return at, interactions
+
+
+def interact(at, action):
+    action()
+    started = time.perf_counter()
+    at.run()
+    elapsed = (time.perf_counter() - started) * 1000
+    if at.exception:
+        raise SystemExit(f"page raised {at.exception[0].value}")
+    settle(at)
+    return elapsed
+
+
+def bench_page(disease, steps, autosave_dir, trips):
+    """Rerun latency and round trips of a scripted annotation session."""
+    at, interactions = page_session(disease, steps, autosave_dir)
+    wall = []
+    trips_per_interaction = []
+    for _, action in interactions:
+        if trips:
+            trips.reset()
+        wall.append(interact(at, action))
+        if trips:
+            trips_per_interaction.append(trips.count)
+
+    stats = perf.summary(f"annotation/{disease}")
+    results = {
+        "rerun_p50_ms": stats["total"]["p50"],
+        "rerun_p95_ms": stats["total"]["p95"],
+        # the first run of a page also pays for imports and the cold caches
+        "open_ms": wall[0],
+        "interaction_p50_ms": statistics.median(wall[1:]),
+        "interaction_max_ms": max(wall[1:]),
+    }
+    for span in ("drug_index", "sidebar", "load_drug"):
+        if span in stats:
+            results[f"{span}_p50_ms"] = stats[span]["p50"]
+    if trips:
+        results["round_trips_per_interaction"] = statistics.mean(trips_per_interaction)
+        results["round_trips_max"] = max(trips_per_interaction)
+    return results
+
+
+def bench_memory(disease, source_dir, steps, autosave_dir):
+    """Peak Python heap of an annotator copy and of a page session.
+
+    Measured in a pass of its own because tracemalloc slows everything
+    down several times.
+    """
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_copies.upload_disease_for_annotator(disease, "memory", source_dir)
+        ingest_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        at, interactions = page_session(f"{disease}_memory", steps, autosave_dir)
+        for _, action in interactions:
+            interact(at, action)
+        page_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"ingest_peak_mb": ingest_peak / 2**20, "page_peak_mb": page_peak / 2**20}
+
+
+def run(scales, steps, backend, trials, articles):
+    workdir = tempfile.mkdtemp(prefix="kgxllm-bench-")
+    if backend == "sqlite":
+        _, trips = use_sqlite(os.path.join(workdir, "bench.sqlite3"))
+    else:
+        _, trips = use_mongomock()
+
+    autosave_dir = os.path.join(workdir, "autosave")
+    # parse the secrets file now, not inside the first timed phase
+    st.secrets.get("STORAGE_BACKEND")
+    results = {}
+    for drugs in scales:
+        disease = f"bench{drugs}"
+        make_disease(disease, drugs, workdir, trials, articles)
+        print(f"{disease}: {drugs} drugs, {trials} trials and {articles} articles each")
+        results[str(drugs)] = {
+            **bench_ingest(disease, workdir, trips),
+            **bench_page(disease, steps, autosave_dir, trips),
+            **bench_memory(disease, workdir, steps, autosave_dir),
+        }
+    return results
+
+
+def lower_is_better(metric):
+    return not metric.endswith("_per_s")
+
+
+def compare(results, baseline, tolerance):
+    """Print every metric next to the baseline; returns the regressions."""
+    regressions = []
+    for scale, metrics in results.items():
+        print(f"\n{scale} drugs")
+        for metric, value in metrics.items():
+            base = baseline.get(scale, {}).get(metric)
+            if not base:
+                print(f"  {metric:<30} {value:>12.2f}")
+                continue
+            change = (value - base) / base
+            worse = change > tolerance if lower_is_better(metric) else change < -tolerance
+            flag = "  REGRESSION" if worse else ""
+            print(f"  {metric:<30} {value:>12.2f}  baseline {base:>12.2f}  {change:+7.1%}{flag}")
+            if worse:
+                regressions.append((scale, metric, value, base))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingest and the annotation page on synthetic diseases, offline."
+    )
+    parser.add_argument("--scales", type=int, nargs="+",
+                        help="drugs per synthetic disease (default 60 1000, plus 10000 on sqlite)")
+    parser.add_argument("--steps", type=int, default=5, help="drugs annotated per page session")
+    parser.add_argument("--backend", choices=["mongo", "sqlite"], default="mongo",
+                        help="mongo runs against mongomock and counts round trips")
+    parser.add_argument("--trials", type=int, default=12, help="clinical trial references per drug")
+    parser.add_argument("--articles", type=int, default=20, help="literature references per drug")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="relative change that counts as a regression (default 0.5 = 50%%)")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on any regression")
+    args = parser.parse_args()
+
+    # the page's unlabeled widgets log a warning on every rerun
+    logging.disable(logging.WARNING)
+    results = run(args.scales or SCALES[args.backend], args.steps, args.backend, args.trials, args.articles)
+
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            stored = json.load(file)
+    regressions = compare(results, stored.get(args.backend, {}), args.tolerance)
+
+    if args.save_baseline:
+        stored[args.backend] = results
+        stored.setdefault("machine", {})[args.backend] = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "recorded": time.strftime("%Y-%m-%d"),
+        }
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(stored, file, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.baseline}")
+    if regressions:
+        print(f"\n{len(regressions)} metrics regressed beyond {args.tolerance:.0%}")
+        if args.check:
+            raise SystemExit(1)
@@ -0,0 +1,120 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+import ingest
+import store
+from benchmarks.synthetic import use_mongomock, use_sqlite
+from ingest import SOURCE_DIR, source_path
+
+# offline checks that re-ingest keeps annotator work, on the same stand-ins
+# as the benchmarks; each returns a list of problems
+
+
+def read_records(disease, source_dir=SOURCE_DIR):
+    with open(source_path(disease, source_dir), "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def write_records(disease, records, source_dir):
+    with open(source_path(disease, source_dir), "w", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def pick_answer(record, options=("In phase II", "In phase III", "No")):
+    """An answer the pipeline did not give for this drug."""
+    return next(option for option in options if option != record["Q1"].get("selection"))
+
+
+def check_migrate_then_ingest(disease="melanoma"):
+    """Answers in a legacy drug_map survive the migrations and the first incremental ingest."""
+    from migrations import run_migrations
+    from store_mongo import diseases_collection
+
+    use_mongomock()
+    records = [record for record in read_records(disease) if isinstance(record.get("Q1"), dict)]
+    answered, untouched = records[0], records[1]
+    drug_map = {record["drug"]: dict(record) for record in records}
+    # saved with Next in the old layout, not confirmed
+    drug_map[answered["drug"]]["Q1"] = {**answered["Q1"], "selection": pick_answer(answered)}
+    diseases_collection().insert_one({"disease": disease, "drug_map": drug_map})
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_migrations()
+        ingest.ingest_disease(disease)
+
+    problems = []
+    doc = store.load_drug(disease, answered["drug"])
+    if doc["Q1"].get("selection") != pick_answer(answered):
+        problems.append(f"migrate -> ingest: {answered['drug']} Q1 became {doc['Q1'].get('selection')!r}")
+    doc = store.load_drug(disease, untouched["drug"])
+    if doc["Q1"].get("selection") != untouched["Q1"].get("selection"):
+        problems.append(f"migrate -> ingest: {untouched['drug']} Q1 is {doc['Q1'].get('selection')!r}")
+    return problems
+
+
+def check_pipeline_refresh(backend, disease="melanoma"):
+    """A changed pipeline answer reaches untouched drugs and never answered or completed ones."""
+    workdir = tempfile.mkdtemp(prefix="kgxllm-checks-")
+    if backend == "sqlite":
+        use_sqlite(os.path.join(workdir, "checks.sqlite3"))
+    else:
+        use_mongomock()
+    records = [record for record in read_records(disease) if isinstance(record.get("Q1"), dict)]
+    write_records(disease, records, workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.ingest_disease(disease, source_dir=workdir)
+
+    untouched, answered, completed = records[:3]
+    answer, completed_answer = pick_answer(answered), completed["Q1"].get("selection")
+    store.bulk_set_drug_fields([(disease, answered["drug"], {"Q1.selection": answer}, 0, "checks")])
+    store.set_completed(disease, completed["drug"])
+    for record in (untouched, answered, completed):
+        record["Q1"] = {**record["Q1"], "selection": "refreshed by the pipeline"}
+    write_records(disease, records, workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.ingest_disease(disease, source_dir=workdir)
+
+    expected = {
+        untouched["drug"]: "refreshed by the pipeline",
+        answered["drug"]: answer,
+        completed["drug"]: completed_answer,
+    }
+    problems = []
+    for drug, want in expected.items():
+        got = store.load_drug(disease, drug)["Q1"].get("selection")
+        if got != want:
+            problems.append(f"{backend} refresh: {drug} Q1 is {got!r}, expected {want!r}")
+    return problems
+
+
+CHECKS = {
+    "migrate-then-ingest": check_migrate_then_ingest,
+    "refresh-mongo": lambda: check_pipeline_refresh("mongo"),
+    "refresh-sqlite": lambda: check_pipeline_refresh("sqlite"),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline checks that re-ingest keeps annotator answers.")
+    parser.add_argument("checks", nargs="*", help=f"checks to run: {', '.join(CHECKS)} (default all)")
+    args = parser.parse_args()
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+
+    logging.disable(logging.WARNING)
+    failed = 0
+    for name in args.checks or CHECKS:
+        problems = CHECKS[name]()
+        print(f"{name}: {'ok' if not problems else 'FAILED'}")
+        for problem in problems:
+            print(f"  {problem}")
+        failed += bool(problems)
+    if failed:
+        raise SystemExit(1)
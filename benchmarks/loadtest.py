@@ -0,0 +1,272 @@
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import MongoClient, monitoring
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.testing.v1 import AppTest
+
+import db
+import ingest
+import perf
+from autosave import get_autosave
+from benchmarks.synthetic import make_disease, use_mongomock, use_sqlite
+from registry import REGISTRY_DEFAULTS, read_registry
+
+PAGE_SCRIPT = """
+from annotation_shared import run_annotation
+run_annotation({disease!r})
+"""
+
+
+def registry_cohort(path):
+    """(disease, annotator) of every copy in the disease registry: the deployed cohort."""
+    return [(entry["name"], entry["annotator"]) for entry in read_registry(path).values()]
+
+
+class PoolCounter(monitoring.ConnectionPoolListener):
+    """Connections opened and checked out at once, for a real MongoDB target."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.max_open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.created = 0
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+            self.open += 1
+            self.max_open = max(self.max_open, self.open)
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    # the remaining pool events are not needed
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.by_action = {}
+        self.errors = {}
+
+    def record(self, action, ms):
+        with self._lock:
+            self.latencies.append(ms)
+            self.by_action.setdefault(action, []).append(ms)
+
+    def error(self, action, exc):
+        with self._lock:
+            key = f"{action}: {type(exc).__name__}: {exc}"[:160]
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def percentile(values, fraction):
+    return perf.percentile(values, fraction) if values else float("nan")
+
+
+def concurrent_apptest():
+    """Let AppTest sessions run on several threads at once.
+
+    AppTest installs a mock Runtime singleton and the global.appTest option
+    for each run and resets both afterwards, which breaks any other session
+    still running. Pin the option and keep handing out the last Runtime
+    instead; every session uses the same secrets, so the swapped st.secrets
+    is equivalent whichever run installed it.
+    """
+    config.set_option("global.appTest", True)
+    original = Runtime.instance.__func__
+    last = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+            return cls._instance
+        return last[0] if last else original(cls)
+
+    Runtime.instance = classmethod(instance)
+
+
+def use_mongo(uri, pool_size):
+    """Point store at a real server, in a database of its own."""
+    import store
+    import store_mongo
+    pool = PoolCounter()
+    client = MongoClient(uri, maxPoolSize=pool_size, event_listeners=[pool])
+    client.admin.command("ping")
+    db.DB_NAME = "kgxllm_loadtest"
+    db.get_client = lambda: client
+    store.backend = lambda: store_mongo
+    return client, pool
+
+
+def prepare(cohort, drugs, workdir):
+    """Load every disease of the cohort; synthetic ones when drugs is given."""
+    source_dir = ingest.SOURCE_DIR
+    if drugs:
+        source_dir = workdir
+        for disease in {disease for disease, _ in cohort}:
+            make_disease(disease, drugs, workdir)
+    jobs = {}
+    for disease, annotator in cohort:
+        jobs.setdefault(disease, [])
+        if annotator:
+            jobs[disease].append(annotator)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.ingest([(disease, annotators or None) for disease, annotators in jobs.items()], source_dir)
+    return [f"{disease}_{annotator}" if annotator else disease for disease, annotator in cohort]
+
+
+def session(number, disease, results, deadline, think, settings):
+    """One annotator: open the page, then annotate drugs until the deadline."""
+    rng = random.Random(number)
+    at = AppTest.from_string(PAGE_SCRIPT.format(disease=disease), default_timeout=120)
+    for key, value in settings.items():
+        at.secrets[key] = value
+
+    def run(action):
+        started = time.perf_counter()
+        try:
+            at.run()
+        except Exception as exc:
+            results.error(action, exc)
+            return False
+        results.record(action, (time.perf_counter() - started) * 1000)
+        if at.exception:
+            results.error(action, RuntimeError(at.exception[0].value))
+            return False
+        return True
+
+    def pause():
+        time.sleep(rng.uniform(0.5, 1.5) * think)
+
+    if not run("open"):
+        return
+    while time.monotonic() < deadline:
+        pause()
+        boxes = list(at.checkbox)
+        for box in rng.sample(boxes, min(len(boxes), rng.randint(1, 2))):
+            box.set_value(not box.value)
+            if not run("toggle"):
+                return
+        pause()
+        at.text_area[0].set_value(f"session {number} note {rng.random():.6f}")
+        if not run("type"):
+            return
+        pause()
+        next(b for b in at.button if b.label == "Confirm").click()
+        if not run("confirm"):
+            return
+        next(b for b in at.button if b.label.startswith("Next")).click()
+        if not run("next"):
+            return
+
+
+def load_test(sessions, duration, think, cohort_keys, settings, ramp):
+    results = Results()
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="annotator") as pool:
+        for number in range(sessions):
+            pool.submit(session, number, cohort_keys[number % len(cohort_keys)], results, deadline, think, settings)
+            # stagger logins instead of opening every page at the same instant
+            time.sleep(ramp / max(1, sessions))
+    elapsed = time.perf_counter() - started
+    autosave_drained = get_autosave().flush(30)
+    return results, elapsed, autosave_drained
+
+
+def report(results, elapsed, sessions, trips, pool, autosave_drained):
+    latencies = results.latencies
+    total = len(latencies)
+    failed = sum(results.errors.values())
+    print(f"{sessions} sessions, {elapsed:.1f} s, {total} reruns, {failed} errors "
+          f"({failed / max(1, total + failed):.2%})")
+    print(f"throughput {total / elapsed:.1f} reruns/s")
+    print(f"rerun latency p50 {percentile(latencies, 0.5):.1f} ms, p95 {percentile(latencies, 0.95):.1f} ms, "
+          f"p99 {percentile(latencies, 0.99):.1f} ms, max {max(latencies, default=float('nan')):.1f} ms")
+    for action, values in sorted(results.by_action.items()):
+        print(f"  {action:<8} n={len(values):<6} p50 {statistics.median(values):8.1f} ms  "
+              f"p95 {percentile(values, 0.95):8.1f} ms  p99 {percentile(values, 0.99):8.1f} ms")
+    if trips:
+        print(f"database calls {trips.count} ({trips.count / elapsed:.1f}/s): "
+              + ", ".join(f"{method} {n}" for method, n in sorted(trips.by_method.items())))
+    if pool:
+        print(f"connections created {pool.created}, open at most {pool.max_open}, "
+              f"checked out at once at most {pool.max_checked_out}")
+    if not autosave_drained:
+        print("autosave queue did not drain within 30 s after the run")
+    for message, count in sorted(results.errors.items(), key=lambda item: -item[1]):
+        print(f"  {count:>5} x {message}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive simulated annotator sessions through the annotation page at once."
+    )
+    parser.add_argument("--registry", default=REGISTRY_DEFAULTS["DISEASE_REGISTRY"],
+                        help="disease registry whose copies the sessions are spread over")
+    parser.add_argument("--sessions", type=int, help="concurrent annotators (default one per copy)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds each annotator keeps working")
+    parser.add_argument("--think", type=float, default=2.0, help="mean seconds between interactions")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which sessions log in")
+    parser.add_argument("--drugs", type=int, help="synthetic drugs per disease instead of the real files")
+    parser.add_argument("--backend", choices=["mongo", "sqlite"], default="mongo",
+                        help="mongo uses mongomock unless --mongo-uri is given")
+    parser.add_argument("--mongo-uri", help="run against this server, in the kgxllm_loadtest database")
+    parser.add_argument("--pool-size", type=int, default=20, help="maxPoolSize with --mongo-uri")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    concurrent_apptest()
+    workdir = tempfile.mkdtemp(prefix="kgxllm-load-")
+    trips = pool = None
+    if args.mongo_uri:
+        client, pool = use_mongo(args.mongo_uri, args.pool_size)
+        client.drop_database(db.DB_NAME)
+    elif args.backend == "sqlite":
+        use_sqlite(os.path.join(workdir, "load.sqlite3"))
+    else:
+        _, trips = use_mongomock()
+
+    cohort = registry_cohort(args.registry)
+    sessions = args.sessions or len(cohort)
+    cohort_keys = prepare(cohort, args.drugs, workdir)
+    settings = {
+        "MONGO_URI": args.mongo_uri or "mongodb://loadtest",
+        "AUTOSAVE_DIR": os.path.join(workdir, "autosave"),
+    }
+    if trips:
+        trips.reset()
+    results, elapsed, drained = load_test(sessions, args.duration, args.think, cohort_keys, settings, args.ramp)
+    report(results, elapsed, sessions, trips, pool, drained)
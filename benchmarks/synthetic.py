@@ -0,0 +1,133 @@
+import copy
+import glob
+import json
+import os
+import random
+import threading
+
+import db
+import store
+from ingest import SOURCE_DIR
+
+# every collection method that is one request to the server
+ROUND_TRIP_METHODS = (
+    "find_one", "find", "aggregate", "count_documents", "distinct",
+    "insert_one", "insert_many", "replace_one", "update_one", "update_many",
+    "delete_one", "delete_many", "bulk_write", "create_index",
+)
+
+
+class RoundTrips:
+    """Thread-safe count of collection calls made against the stand-in."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.by_method = {}
+
+    def add(self, method):
+        with self._lock:
+            self.count += 1
+            self.by_method[method] = self.by_method.get(method, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.by_method = {}
+
+
+def use_mongomock():
+    """Point store at an in-memory mongomock client; returns (client, RoundTrips)."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("The benchmarks need mongomock: pip install -r benchmarks/requirements.txt")
+
+    trips = RoundTrips()
+    collection_class = mongomock.collection.Collection
+    for method in ROUND_TRIP_METHODS:
+        original = getattr(collection_class, method)
+        if getattr(original, "_counted", False):
+            original = original.__wrapped__
+
+        def counted(self, *args, _original=original, _method=method, **kwargs):
+            trips.add(_method)
+            return _original(self, *args, **kwargs)
+
+        counted._counted = True
+        counted.__wrapped__ = original
+        setattr(collection_class, method, counted)
+
+    client = mongomock.MongoClient()
+    db.get_client = lambda: client
+    import store_mongo
+    store.backend = lambda: store_mongo
+    return client, trips
+
+
+def use_sqlite(path):
+    """Point store at a fresh SQLite file; round trips are not counted."""
+    import store_sqlite
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    store_sqlite.sqlite_path = lambda: path
+    store.backend = lambda: store_sqlite
+    return None, None
+
+
+def load_templates(source_dir=SOURCE_DIR):
+    """Real pre-annotated records, the shape every synthetic drug copies."""
+    templates = []
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.pre_annotated.jsonl"))):
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                if isinstance(record.get("Q1"), dict) and isinstance(record.get("Q2"), dict):
+                    templates.append(record)
+    return templates
+
+
+def _trial(template, number):
+    trial = copy.deepcopy(template)
+    summary = trial.setdefault("study_summary", {})
+    summary.pop("nct_id", None)
+    summary["NCTID"] = f"NCT9{number:07d}"
+    summary["title"] = f"{summary.get('title', 'Synthetic trial')} (synthetic {number})"
+    return trial
+
+
+def _article(number):
+    return f"Synthetic pre-clinical study {number} of drug response. [https://pubmed.ncbi.nlm.nih.gov/9{number:07d}/]"
+
+
+def make_disease(name, drugs, out_dir, trials_per_drug=12, articles_per_drug=20, seed=0):
+    """Write out_dir/<name>.pre_annotated.jsonl with synthetic drugs.
+
+    Drugs copy real records round-robin. Their reference lists are drawn
+    from a pool about three times the per-drug size per 100 drugs, so
+    references repeat across drugs the way real trials do. Returns the path.
+    """
+    rng = random.Random(seed)
+    templates = load_templates()
+    trial_templates = [
+        ref for record in templates
+        for ref in record["Q1"].get("clinicaltrial_references") or []
+        if isinstance(ref, dict)
+    ]
+    pool = max(trials_per_drug, articles_per_drug) * 3 * max(1, drugs // 100)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{name}.pre_annotated.jsonl")
+    with open(path, "w", encoding="utf-8") as file:
+        for i in range(drugs):
+            record = copy.deepcopy(templates[i % len(templates)])
+            record["disease"] = name
+            record["drug"] = f"{record['drug']}-{i:05d}"
+            record["Q1"]["clinicaltrial_references"] = [
+                _trial(trial_templates[n % len(trial_templates)], n)
+                for n in rng.sample(range(pool), trials_per_drug)
+            ]
+            record["Q2"]["literature_references"] = [_article(n) for n in rng.sample(range(pool), articles_per_drug)]
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return path
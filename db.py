@@ -0,0 +1,75 @@
+import streamlit as st
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+import perf
+
+DB_NAME = "kgxllm"
+
+# client settings that can be overridden from .streamlit/secrets.toml
+CLIENT_DEFAULTS = {
+    "MONGO_MAX_POOL_SIZE": 20,
+    "MONGO_MIN_POOL_SIZE": 2,
+    "MONGO_MAX_IDLE_TIME_MS": 300000,
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": 5000,
+    "MONGO_CONNECT_TIMEOUT_MS": 5000,
+    "MONGO_SOCKET_TIMEOUT_MS": 20000,
+    "MONGO_HEARTBEAT_FREQUENCY_MS": 10000,
+    "MONGO_COMPRESSORS": "zlib",
+}
+
+
+def client_options():
+    """Keyword arguments for MongoClient, read from secrets with defaults."""
+    conf = {key: st.secrets.get(key, default) for key, default in CLIENT_DEFAULTS.items()}
+    return {
+        "maxPoolSize": int(conf["MONGO_MAX_POOL_SIZE"]),
+        "minPoolSize": int(conf["MONGO_MIN_POOL_SIZE"]),
+        "maxIdleTimeMS": int(conf["MONGO_MAX_IDLE_TIME_MS"]),
+        "serverSelectionTimeoutMS": int(conf["MONGO_SERVER_SELECTION_TIMEOUT_MS"]),
+        "connectTimeoutMS": int(conf["MONGO_CONNECT_TIMEOUT_MS"]),
+        "socketTimeoutMS": int(conf["MONGO_SOCKET_TIMEOUT_MS"]),
+        "heartbeatFrequencyMS": int(conf["MONGO_HEARTBEAT_FREQUENCY_MS"]),
+        "compressors": conf["MONGO_COMPRESSORS"],
+        # replay a read/write once on a new primary after a failover
+        "retryReads": True,
+        "retryWrites": True,
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """One MongoClient (and connection pool) per server process.
+
+    Shared by every page and session. If the warm-up ping fails the client
+    is closed and nothing is cached, so the next rerun simply tries again
+    without leaving monitor threads and pool sockets behind.
+    """
+    with perf.span("mongo_connect"):
+        client = MongoClient(
+            st.secrets["MONGO_URI"],
+            event_listeners=perf.event_listeners(),
+            **client_options()
+        )
+        # warm up: server discovery, TLS and the first pooled socket happen here
+        try:
+            client.admin.command("ping")
+        except Exception:
+            client.close()
+            raise
+    return client
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+@st.cache_resource(show_spinner=False)
+def supports_transactions():
+    """Whether the server runs multi-document transactions (a replica set or mongos)."""
+    try:
+        hello = get_client().admin.command("hello")
+    except (NotImplementedError, OperationFailure):
+        # mongomock, or a server too old to know "hello"
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
@@ -0,0 +1,242 @@
+import argparse
+import csv
+import json
+import os
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+from store import iter_annotations
+
+ROW_FIELDS = [
+    "disease",
+    "parent_disease",
+    "annotator",
+    "drug",
+    "order",
+    "completed",
+    "version",
+    "Q1_selection",
+    "Q2_selection",
+    "Q3_interest",
+    "Q4_notes",
+]
+
+# only what a row needs; reference lists stay on the server
+ROW_PROJECTION = {
+    "_id": 0,
+    "disease": 1,
+    "parent_disease": 1,
+    "annotator": 1,
+    "drug": 1,
+    "order": 1,
+    "completed": 1,
+    "version": 1,
+    "Q1.selection": 1,
+    "Q2.selection": 1,
+    "Q3_interest": 1,
+    "Q4_notes": 1,
+}
+
+
+def clean_ids(obj):
+    """Replace ObjectIds with their hex string, recursively."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, dict):
+        return {k: clean_ids(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [clean_ids(v) for v in obj]
+    return obj
+
+
+def iter_dump_docs(path):
+    """Stream documents from a mongoexport-style dump (one document per line).
+
+    Pretty-printed single-document files such as pancreatic_annotations.json
+    are read whole as a fallback.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line, object_hook=json_util.object_hook)
+            except json.JSONDecodeError:
+                f.seek(0)
+                parsed = json.load(f, object_hook=json_util.object_hook)
+                yield from parsed if isinstance(parsed, list) else [parsed]
+                return
+
+
+def iter_dump_drugs(path):
+    """Drug documents from a dump of either storage layout.
+
+    Documents with an embedded drug_map are split into one document per drug
+    the same way migrations.py does.
+    """
+    for doc in iter_dump_docs(path):
+        if "drug_map" not in doc:
+            yield doc
+            continue
+        disease = doc.get("disease")
+        for order, (drug, data) in enumerate(doc["drug_map"].items()):
+            yield {
+                **data,
+                "disease": disease,
+                "parent_disease": doc.get("parent_disease", disease),
+                "annotator": doc.get("annotator"),
+                "drug": drug,
+                "order": order,
+            }
+
+
+def to_row(doc):
+    """Flatten one drug document into an export row."""
+    q1 = doc.get("Q1") if isinstance(doc.get("Q1"), dict) else {}
+    q2 = doc.get("Q2") if isinstance(doc.get("Q2"), dict) else {}
+    q2_selection = q2.get("selection") or []
+    if isinstance(q2_selection, str):
+        q2_selection = [q2_selection]
+    return {
+        "disease": doc.get("disease"),
+        "parent_disease": doc.get("parent_disease", doc.get("disease")),
+        "annotator": doc.get("annotator"),
+        "drug": doc.get("drug"),
+        "order": doc.get("order"),
+        "completed": bool(doc.get("completed", False)),
+        "version": doc.get("version", 0),
+        "Q1_selection": q1.get("selection"),
+        "Q2_selection": list(q2_selection),
+        "Q3_interest": doc.get("Q3_interest"),
+        "Q4_notes": doc.get("Q4_notes", ""),
+    }
+
+
+def iter_rows(dumps=None, parent_diseases=None, annotators=None):
+    """Rows from dump files if given, otherwise straight from the database."""
+    if dumps:
+        for path in dumps:
+            for doc in iter_dump_drugs(path):
+                if parent_diseases and doc.get("parent_disease", doc.get("disease")) not in parent_diseases:
+                    continue
+                if annotators and doc.get("annotator") not in annotators:
+                    continue
+                yield to_row(doc)
+        return
+
+    for doc in iter_annotations(parent_diseases, annotators, projection=ROW_PROJECTION):
+        yield to_row(doc)
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=ROW_FIELDS)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            self.writer.writerow({**row, "Q2_selection": "; ".join(row["Q2_selection"])})
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("disease", pa.string()),
+            ("parent_disease", pa.string()),
+            ("annotator", pa.string()),
+            ("drug", pa.string()),
+            ("order", pa.int64()),
+            ("completed", pa.bool_()),
+            ("Q1_selection", pa.string()),
+            ("Q2_selection", pa.list_(pa.string())),
+            ("Q3_interest", pa.string()),
+            ("Q4_notes", pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        if rows:
+            self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    ".jsonl": JsonlWriter,
+    ".csv": CsvWriter,
+    ".parquet": ParquetWriter,
+}
+
+
+def export(outputs, dumps=None, parent_diseases=None, annotators=None, batch_size=1000):
+    """Write the selected rows to every output path in a single pass.
+
+    The format follows each path's extension. Rows are buffered at most
+    batch_size at a time, so memory stays flat however many diseases and
+    annotators are exported. Returns the number of rows written.
+    """
+    writers = []
+    for path in outputs:
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in WRITERS:
+            raise SystemExit(f"Unknown export format for {path}; use one of {', '.join(WRITERS)}")
+        writers.append(WRITERS[extension](path))
+
+    count = 0
+    batch = []
+    try:
+        for row in iter_rows(dumps, parent_diseases, annotators):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                for writer in writers:
+                    writer.write(batch)
+                count += len(batch)
+                batch = []
+        for writer in writers:
+            writer.write(batch)
+        count += len(batch)
+    finally:
+        for writer in writers:
+            writer.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export annotations as JSONL, CSV or Parquet.")
+    parser.add_argument("outputs", nargs="+", help="output files, e.g. annotations.csv annotations.parquet")
+    parser.add_argument("--dump", action="append", dest="dumps",
+                        help="read a mongoexport dump instead of the database (repeatable)")
+    parser.add_argument("--disease", action="append", dest="diseases",
+                        help="parent disease to export, e.g. glioblastoma (repeatable)")
+    parser.add_argument("--annotator", action="append", dest="annotators",
+                        help="annotator to export (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    n = export(args.outputs, args.dumps, args.diseases, args.annotators, args.batch_size)
+    print(f"Exported {n} rows to {', '.join(args.outputs)}")
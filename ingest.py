@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from references import extract_references, forget_references
+from store import (
+    ensure_indexes,
+    finish_disease,
+    load_fingerprints,
+    record_fingerprint,
+    save_references,
+    sync_drugs,
+    write_drugs,
+)
+
+SOURCE_DIR = "new_drug_results"
+# part of every source_hash; bump it when the stored form of a record
+# changes, so the next incremental ingest refreshes every drug once
+# (2: reference ids carry a content hash)
+STORED_LAYOUT = 2
+
+
+def source_path(disease, source_dir=SOURCE_DIR):
+    return os.path.join(source_dir, f"{disease}.pre_annotated.jsonl")
+
+
+def disease_copies(disease, annotators=None):
+    """(disease key, parent disease, annotator) for each copy to write.
+
+    Without annotators the disease is stored under its own name, as
+    upload_jsonl.py did; otherwise one "<disease>_<annotator>" copy each, as
+    create_copies.py did.
+    """
+    disease = disease.strip().lower()
+    if not annotators:
+        return [(disease, disease, None)]
+    copies = []
+    for annotator in annotators:
+        annotator = annotator.strip().lower().replace(" ", "_")
+        copies.append((f"{disease}_{annotator}", disease, annotator))
+    return copies
+
+
+def iter_records(path):
+    """Stream (line_no, record, problem) from a pre-annotated JSONL file.
+
+    problem is None for a good record, ("error", msg) for a line that must be
+    skipped and ("warning", msg) for a record that is kept but incomplete.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        for line_no, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield line_no, None, ("error", f"invalid JSON: {exc.msg}")
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, ("error", "not a JSON object")
+                continue
+            drug = record.get("drug")
+            if not isinstance(drug, str) or not drug.strip():
+                yield line_no, None, ("error", "missing drug name")
+                continue
+            missing = [q for q in ("Q1", "Q2") if not isinstance(record.get(q), dict)]
+            if missing:
+                yield line_no, record, ("warning", f"{drug}: no {' or '.join(missing)} section")
+                continue
+            yield line_no, record, None
+
+
+def ingest_disease(disease, annotators=None, source_dir=SOURCE_DIR, batch_size=500, incremental=True):
+    """Parse one disease file once and write it to every annotator copy.
+
+    Lines are streamed and written in batches, so memory does not grow with
+    the file. A drug listed twice keeps its first position and its last
+    record, like the old drug_map did.
+
+    In incremental mode (the default) each record is fingerprinted and only
+    new or changed drugs are written, without touching annotator answers;
+    drugs missing from the file are kept. Otherwise every drug is replaced
+    and drugs missing from the file are deleted.
+
+    Reference lists are moved to the shared references collection; drug
+    documents only keep their ids.
+    """
+    started = time.perf_counter()
+    copies = disease_copies(disease, annotators)
+    report = {
+        "disease": disease,
+        "copies": [c[0] for c in copies],
+        "drugs": 0,
+        "new": 0,
+        "changed": 0,
+        "unchanged": 0,
+        "errors": [],
+        "warnings": [],
+    }
+    existing = {key: load_fingerprints(key) for key, _, _ in copies} if incremental else {}
+
+    orders = {}
+    batch = []
+    batch_drugs = set()
+    batch_refs = {}
+
+    def flush():
+        # references first, so a drug never points at a missing reference
+        save_references(batch_refs.values())
+        forget_references(batch_refs)
+        batch_refs.clear()
+        if incremental:
+            for key, count in sync_drugs(copies, batch, existing).items():
+                report[key] += count
+        else:
+            write_drugs(copies, batch)
+        batch.clear()
+        batch_drugs.clear()
+
+    for line_no, record, problem in iter_records(source_path(disease, source_dir)):
+        if problem:
+            level, message = problem
+            report[f"{level}s"].append((line_no, message))
+            if record is None:
+                continue
+
+        drug = record["drug"]
+        if drug in batch_drugs:
+            # keep the two versions of a repeated drug in separate bulk writes
+            flush()
+        order = orders.setdefault(drug, len(orders))
+        source_hash = record_fingerprint([STORED_LAYOUT, record])
+        unchanged = incremental and all(
+            existing[key].get(drug, {}).get("source_hash") == source_hash for key, _, _ in copies
+        )
+        # an unchanged drug is not written, so its references need no work
+        if not unchanged:
+            record, ref_docs = extract_references(record)
+            for ref_doc in ref_docs:
+                batch_refs.setdefault(ref_doc["_id"], ref_doc)
+        batch.append((order, record, source_hash))
+        batch_drugs.add(drug)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    for disease_key, parent_disease, annotator in copies:
+        finish_disease(disease_key, orders, parent_disease, annotator, prune=not incremental)
+
+    report["drugs"] = len(orders)
+    if incremental:
+        report["kept"] = sum(len(set(stored) - set(orders)) for stored in existing.values())
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def print_report(report):
+    copies = ", ".join(report["copies"])
+    print(f"{report['disease']}: {report['drugs']} drugs -> {copies} ({report['seconds']:.2f}s)")
+    if "kept" in report:
+        print(f"  {report['new']} new, {report['changed']} changed, {report['unchanged']} unchanged, "
+              f"{report['kept']} kept (no longer in the source file)")
+    for line_no, message in report["errors"]:
+        print(f"  error   line {line_no}: {message}")
+    for line_no, message in report["warnings"]:
+        print(f"  warning line {line_no}: {message}")
+
+
+def ingest(jobs, source_dir=SOURCE_DIR, batch_size=500, workers=4, incremental=True):
+    """Ingest [(disease, annotators), ...] in a worker pool, one job per disease."""
+    ensure_indexes()
+    reports = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(ingest_disease, disease, annotators, source_dir, batch_size, incremental): disease
+            for disease, annotators in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                report = future.result()
+            except OSError as exc:
+                report = {"disease": futures[future], "copies": [], "drugs": 0,
+                          "errors": [(0, str(exc))], "warnings": [], "seconds": 0.0}
+            print_report(report)
+            reports.append(report)
+    return reports
+
+
+def parse_jobs(specs, default_annotators=None):
+    """Turn specs like "glioblastoma:betty,hasan" into (disease, annotators) jobs."""
+    jobs = []
+    for spec in specs:
+        disease, _, names = spec.partition(":")
+        annotators = [name for name in names.split(",") if name] if names else default_annotators
+        jobs.append((disease, annotators or None))
+    return jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load pre-annotated drug files into the annotation database."
+    )
+    parser.add_argument("diseases", nargs="*",
+                        help="disease names, e.g. melanoma; use glioblastoma:betty,hasan "
+                             "to give one disease its own annotators")
+    parser.add_argument("--registry", metavar="PATH",
+                        help="load every disease and annotator copy listed in this file, e.g. diseases.toml")
+    parser.add_argument("--annotators", nargs="*", default=None,
+                        help="annotator copies to create for every disease without its own list")
+    parser.add_argument("--source-dir", default=SOURCE_DIR)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--replace", action="store_true",
+                        help="rewrite every drug and delete drugs missing from the file; "
+                             "this discards annotator answers")
+    args = parser.parse_args()
+    if not args.diseases and not args.registry:
+        parser.error("name some diseases or pass --registry")
+
+    jobs = parse_jobs(args.diseases, args.annotators)
+    if args.registry:
+        from registry import read_registry, registry_jobs
+        jobs += registry_jobs(read_registry(args.registry))
+    reports = ingest(
+        jobs,
+        args.source_dir,
+        args.batch_size,
+        args.workers,
+        incremental=not args.replace,
+    )
+    raise SystemExit(1 if any(report["errors"] for report in reports) else 0)
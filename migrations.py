@@ -0,0 +1,188 @@
+import argparse
+import datetime
+
+from pymongo import UpdateOne
+
+from references import extract_references
+from store import DRUG_DEFAULTS, drug_doc
+# migrations rewrite documents in place and only apply to MongoDB
+from store_mongo import (
+    annotations_collection,
+    diseases_collection,
+    ensure_indexes,
+    meta_collection,
+    save_references,
+)
+
+SCHEMA_META_ID = "schema"
+
+
+def migrate_embedded_drug_maps(batch_size=500):
+    """Split legacy diseases.drug_map documents into the annotations collection.
+
+    Safe to interrupt and re-run: drugs are inserted with $setOnInsert, so a
+    drug that already exists (and may have new answers) is left alone, and a
+    disease is only marked done once all its drugs are written.
+    """
+    ensure_indexes()
+    diseases = diseases_collection()
+    annotations = annotations_collection()
+
+    pending = diseases.find(
+        {"drug_map": {"$exists": True}, "layout": {"$ne": "annotations"}},
+        {"_id": 1, "disease": 1}
+    )
+    for summary in list(pending):
+        doc = diseases.find_one({"_id": summary["_id"]})
+        disease = doc["disease"]
+        parent_disease = doc.get("parent_disease", disease)
+        annotator = doc.get("annotator")
+
+        requests = []
+        for order, (drug, record) in enumerate(doc["drug_map"].items()):
+            # legacy records hold the annotator's answers, not the pipeline's
+            new_doc = drug_doc(disease, {**record, "drug": drug}, order, parent_disease, annotator, prefill=False)
+            requests.append(UpdateOne(
+                {"disease": disease, "drug": drug},
+                {"$setOnInsert": new_doc},
+                upsert=True
+            ))
+            if len(requests) >= batch_size:
+                annotations.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            annotations.bulk_write(requests, ordered=False)
+
+        diseases.update_one({"_id": doc["_id"]}, {"$set": {
+            "parent_disease": parent_disease,
+            "annotator": annotator,
+            "drug_count": len(doc["drug_map"]),
+            "layout": "annotations",
+        }})
+        print(f"Migrated {disease} with {len(doc['drug_map'])} drugs.")
+
+
+def apply_drug_defaults():
+    """Fill in DRUG_DEFAULTS on drugs written before the default existed."""
+    collection = annotations_collection()
+    for field, value in DRUG_DEFAULTS.items():
+        result = collection.update_many({field: {"$exists": False}}, {"$set": {field: value}})
+        print(f"Set {field}={value!r} on {result.modified_count} drugs.")
+
+
+def externalize_references(batch_size=500):
+    """Move inline reference lists into the shared references collection.
+
+    Drugs keep only clinicaltrial_ref_ids / literature_ref_ids. Documents are
+    picked up by the inline field itself, so an interrupted run resumes.
+    """
+    collection = annotations_collection()
+    inline = {"$or": [
+        {"Q1.clinicaltrial_references": {"$exists": True}},
+        {"Q2.literature_references": {"$exists": True}},
+    ]}
+    moved = 0
+    while True:
+        docs = list(collection.find(inline, {"Q1": 1, "Q2": 1}).limit(batch_size))
+        if not docs:
+            break
+        ref_docs = {}
+        requests = []
+        for doc in docs:
+            slim, refs = extract_references({"Q1": doc.get("Q1"), "Q2": doc.get("Q2")})
+            for ref_doc in refs:
+                ref_docs.setdefault(ref_doc["_id"], ref_doc)
+            updates = {f"{q}.{k}": v for q in ("Q1", "Q2") if isinstance(slim.get(q), dict)
+                       for k, v in slim[q].items() if k.endswith("_ref_ids")}
+            requests.append(UpdateOne({"_id": doc["_id"]}, {
+                "$set": updates,
+                "$unset": {"Q1.clinicaltrial_references": "", "Q2.literature_references": "", "references_md": ""},
+            }))
+        save_references(ref_docs.values())
+        collection.bulk_write(requests, ordered=False)
+        moved += len(requests)
+    print(f"Moved references of {moved} drugs to the references collection.")
+
+
+def count_completed_drugs():
+    """Backfill diseases.completed_count, which set_completed keeps up to date from now on."""
+    counts = {
+        row["_id"]: row["completed"]
+        for row in annotations_collection().aggregate([
+            {"$match": {"completed": True}},
+            {"$group": {"_id": "$disease", "completed": {"$sum": 1}}},
+        ])
+    }
+    diseases = diseases_collection()
+    for doc in diseases.find({}, {"disease": 1}):
+        diseases.update_one({"_id": doc["_id"]}, {"$set": {"completed_count": counts.get(doc["disease"], 0)}})
+    print(f"Counted completed drugs for {len(counts)} diseases.")
+
+
+# (version, description, function); append only, never renumber
+MIGRATIONS = [
+    (1, "split diseases.drug_map into one annotations document per drug", migrate_embedded_drug_maps),
+    (2, "default completed=False on every drug", apply_drug_defaults),
+    (3, "move inline references to the shared references collection", externalize_references),
+    (4, "count completed drugs per disease", count_completed_drugs),
+    (5, "default version=0 on every drug", apply_drug_defaults),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version():
+    meta = meta_collection().find_one({"_id": SCHEMA_META_ID})
+    return meta["version"] if meta else 0
+
+
+def run_migrations(target=LATEST_VERSION):
+    """Apply every migration newer than the recorded schema version."""
+    current = schema_version()
+    for version, description, migrate in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        print(f"Applying migration {version}: {description}")
+        migrate()
+        meta_collection().update_one(
+            {"_id": SCHEMA_META_ID},
+            {
+                "$set": {"version": version},
+                "$push": {"history": {
+                    "version": version,
+                    "description": description,
+                    "applied_at": datetime.datetime.now(datetime.timezone.utc),
+                }},
+            },
+            upsert=True
+        )
+        current = version
+    print(f"Schema is at version {current}.")
+    return current
+
+
+def drop_embedded_drug_maps():
+    """Remove drug_map from disease documents that have been migrated."""
+    result = diseases_collection().update_many(
+        {"layout": "annotations", "drug_map": {"$exists": True}},
+        {"$unset": {"drug_map": ""}}
+    )
+    print(f"Dropped drug_map from {result.modified_count} diseases.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade stored documents to the latest schema version.")
+    parser.add_argument("--target", type=int, default=LATEST_VERSION,
+                        help="stop after this schema version")
+    parser.add_argument("--status", action="store_true",
+                        help="print the recorded schema version and exit")
+    parser.add_argument("--drop-embedded", action="store_true",
+                        help="remove drug_map from each disease document once it is migrated")
+    args = parser.parse_args()
+
+    if args.status:
+        print(f"Schema is at version {schema_version()} (latest {LATEST_VERSION}).")
+    else:
+        run_migrations(args.target)
+        if args.drop_embedded:
+            drop_embedded_drug_maps()
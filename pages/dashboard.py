@@ -0,0 +1,46 @@
+import streamlit as st
+
+from annotation_shared import display_disease_name
+from store import load_disease_summaries, load_status_counts
+
+st.title("Annotation Progress")
+
+summaries = load_disease_summaries()
+if not summaries:
+    st.info("No diseases have been uploaded yet.")
+    st.stop()
+
+# one aggregation for every status distribution; progress comes from the maintained counters
+q1_counts = load_status_counts("Q1.selection")
+
+total = sum(doc.get("drug_count", 0) for doc in summaries)
+done = sum(doc.get("completed_count", 0) for doc in summaries)
+col1, col2, col3 = st.columns(3)
+col1.metric("Diseases", len(summaries))
+col2.metric("Drugs completed", f"{done}/{total}")
+col3.metric("Overall", f"{done / total:.0%}" if total else "–")
+
+parent = None
+for doc in summaries:
+    if doc.get("parent_disease") != parent:
+        parent = doc.get("parent_disease")
+        st.subheader(display_disease_name(parent or doc["disease"]))
+    drug_count = doc.get("drug_count", 0)
+    completed_count = doc.get("completed_count", 0)
+    label = doc.get("annotator") or doc["disease"]
+    st.progress(
+        completed_count / drug_count if drug_count else 0.0,
+        text=f"{label}: {completed_count}/{drug_count} completed",
+    )
+
+st.subheader("Q1 status by disease")
+statuses = sorted({status or "Unanswered" for counts in q1_counts.values() for status in counts})
+rows = []
+for doc in summaries:
+    counts = {status or "Unanswered": n for status, n in q1_counts.get(doc["disease"], {}).items()}
+    rows.append({
+        "disease": doc["disease"],
+        "annotator": doc.get("annotator") or "",
+        **{status: counts.get(status, 0) for status in statuses},
+    })
+st.dataframe(rows, hide_index=True, use_container_width=True)
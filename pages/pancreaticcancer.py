@@ -1,2 +0,0 @@
-from annotation_shared import run_annotation
-run_annotation("pancreaticcancer")
\ No newline at end of file
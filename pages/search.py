@@ -0,0 +1,40 @@
+import time
+
+import streamlit as st
+
+from annotation_shared import display_disease_name
+from search_index import build_index, index_facets, search
+
+st.title("Search")
+st.caption('Drugs, trials, literature, rationales and annotator notes. End a word with * to match a prefix, e.g. "PI3K inhib*".')
+
+diseases, annotators = index_facets()
+if not diseases:
+    st.info("The search index is empty. Build it here or with `python search_index.py --build`.")
+
+query = st.text_input("Search", key="search_query", placeholder="selumetinib")
+col1, col2 = st.columns(2)
+picked_diseases = col1.multiselect("Disease", diseases, format_func=display_disease_name, key="search_diseases")
+picked_annotators = col2.multiselect("Annotator notes", annotators, key="search_annotators")
+
+if query:
+    started = time.perf_counter()
+    try:
+        results = search(query, picked_diseases, picked_annotators, limit=100)
+    except ValueError as exc:
+        st.error(str(exc))
+        st.stop()
+    st.caption(f"{len(results)} results in {(time.perf_counter() - started) * 1000:.1f} ms")
+    for row in results:
+        where = display_disease_name(row["disease"])
+        if row["annotator"]:
+            where += f" · {row['annotator']}"
+        st.markdown(f"**{row['drug']}** — {where} · _{row['field']}_  \n{row['snippet']}")
+
+if st.button("Update index"):
+    with st.spinner("Indexing…"):
+        counts = build_index()
+    st.success(
+        f"Indexed {counts['indexed']} drugs, {counts['unchanged']} unchanged, "
+        f"{counts['removed']} removed, {counts['files_skipped']} files unchanged."
+    )
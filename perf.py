@@ -0,0 +1,202 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import bson
+import streamlit as st
+from pymongo import monitoring
+
+PERF_DEFAULTS = {
+    "PERF_ENABLED": True,
+    # reruns kept per page for the rolling percentiles
+    "PERF_WINDOW": 200,
+    # append one JSON line per rerun here; empty to disable
+    "PERF_METRICS_FILE": "",
+    "PERF_DEBUG_PANEL": False,
+}
+
+logger = logging.getLogger("kgxllm.perf")
+
+# the rerun being timed on this thread, if any
+_current = threading.local()
+
+# page -> metric name -> recent values in ms
+_STATS = defaultdict(dict)
+# page -> last finished rerun record
+_LAST = {}
+_LOCK = threading.Lock()
+
+
+def perf_setting(key):
+    return st.secrets.get(key, PERF_DEFAULTS[key])
+
+
+def enabled():
+    return bool(perf_setting("PERF_ENABLED"))
+
+
+def _new_record(page):
+    return {
+        "page": page,
+        "spans": defaultdict(float),
+        "mongo": {"commands": 0, "ms": 0.0, "bytes_out": 0, "bytes_in": 0, "failed": 0,
+                  "by_command": defaultdict(int)},
+    }
+
+
+@contextmanager
+def rerun(page):
+    """Time one script run of a page; spans and Mongo commands inside it are attached to it.
+
+    st.rerun() and st.stop() end a run by raising, so the record is closed
+    in finally and still counted.
+    """
+    if not enabled():
+        yield
+        return
+    record = _new_record(page)
+    _current.record = record
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.record = None
+        record["total_ms"] = (time.perf_counter() - start) * 1000
+        _finish(record)
+
+
+@contextmanager
+def span(name):
+    """Add the time spent inside the block to the current rerun under name."""
+    record = getattr(_current, "record", None)
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["spans"][name] += (time.perf_counter() - start) * 1000
+
+
+def _finish(record):
+    record["ts"] = time.time()
+    record["spans"] = {name: round(ms, 3) for name, ms in record["spans"].items()}
+    record["mongo"]["by_command"] = dict(record["mongo"]["by_command"])
+    record["mongo"]["ms"] = round(record["mongo"]["ms"], 3)
+    record["total_ms"] = round(record["total_ms"], 3)
+
+    window = int(perf_setting("PERF_WINDOW"))
+    metrics = {"total": record["total_ms"], "mongo": record["mongo"]["ms"], **record["spans"]}
+    with _LOCK:
+        page_stats = _STATS[record["page"]]
+        for name, ms in metrics.items():
+            page_stats.setdefault(name, deque(maxlen=window)).append(ms)
+        _LAST[record["page"]] = record
+
+    line = json.dumps(record, default=str)
+    logger.info(line)
+    path = perf_setting("PERF_METRICS_FILE")
+    if path:
+        with _LOCK, open(path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summary(page):
+    """{metric: {"n", "p50", "p95"}} over the rolling window of a page."""
+    with _LOCK:
+        page_stats = {name: list(values) for name, values in _STATS.get(page, {}).items()}
+    return {
+        name: {"n": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+        for name, values in page_stats.items()
+    }
+
+
+def last_rerun(page):
+    with _LOCK:
+        return _LAST.get(page)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Counts Mongo commands, their latency and wire size against the current rerun.
+
+    pymongo calls listeners on the thread that runs the command, so work of
+    the autosave and prefetch threads is not charged to any page. Sizes
+    mean encoding every command and reply a second time, so they are only
+    counted with count_bytes.
+    """
+
+    def __init__(self, count_bytes=False):
+        self.count_bytes = count_bytes
+
+    def started(self, event):
+        record = getattr(_current, "record", None)
+        if record is None:
+            return
+        mongo = record["mongo"]
+        mongo["commands"] += 1
+        mongo["by_command"][event.command_name] += 1
+        if self.count_bytes:
+            mongo["bytes_out"] += len(bson.encode(event.command))
+
+    def succeeded(self, event):
+        record = getattr(_current, "record", None)
+        if record is None:
+            return
+        record["mongo"]["ms"] += event.duration_micros / 1000
+        if self.count_bytes and isinstance(event.reply, dict):
+            record["mongo"]["bytes_in"] += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        record = getattr(_current, "record", None)
+        if record is None:
+            return
+        record["mongo"]["ms"] += event.duration_micros / 1000
+        record["mongo"]["failed"] += 1
+
+
+def event_listeners():
+    """Listeners for MongoClient(event_listeners=...); none when instrumentation is off.
+
+    Wire sizes are only counted when something shows or stores them: the
+    debug panel or the metrics file.
+    """
+    if not enabled():
+        return []
+    return [CommandTimer(bool(perf_setting("PERF_DEBUG_PANEL") or perf_setting("PERF_METRICS_FILE")))]
+
+
+def debug_panel(page):
+    """Sidebar expander with the last rerun and rolling percentiles of a page."""
+    if not enabled() or not perf_setting("PERF_DEBUG_PANEL"):
+        return
+    last = last_rerun(page)
+    with st.sidebar.expander("Performance"):
+        if last is None:
+            st.caption("No finished rerun yet.")
+            return
+        mongo = last["mongo"]
+        last_values = {"total": last["total_ms"], "mongo": mongo["ms"], **last["spans"]}
+        st.caption(
+            f"Last rerun {last['total_ms']:.1f} ms · Mongo {mongo['commands']} commands, "
+            f"{mongo['ms']:.1f} ms, {mongo['bytes_out'] + mongo['bytes_in']:,} bytes"
+        )
+        st.dataframe(
+            [
+                {"metric": name, "last ms": last_values.get(name),
+                 "p50 ms": stats["p50"], "p95 ms": stats["p95"], "reruns": stats["n"]}
+                for name, stats in summary(page).items()
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
@@ -0,0 +1,93 @@
+import copy
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import streamlit as st
+
+from references import drug_references_md
+from store import load_drug
+
+PREFETCH_DEFAULTS = {
+    "PREFETCH_WORKERS": 4,
+    "PREFETCH_CACHE_SIZE": 8,
+    "PREFETCH_TTL_S": 30,
+}
+
+
+def prefetch_setting(key):
+    return st.secrets.get(key, PREFETCH_DEFAULTS[key])
+
+
+@st.cache_resource(show_spinner=False)
+def get_prefetch_pool():
+    """Worker threads shared by every session for background drug loads."""
+    return ThreadPoolExecutor(
+        max_workers=int(prefetch_setting("PREFETCH_WORKERS")),
+        thread_name_prefix="prefetch",
+    )
+
+
+def load_drug_view(disease, drug, with_references=True):
+    """A drug document plus, optionally, its rendered reference panels."""
+    doc = load_drug(disease, drug)
+    if doc is None or not with_references:
+        return {"doc": doc, "references_md": {}}
+    return {"doc": doc, "references_md": drug_references_md(doc)}
+
+
+def _session_cache():
+    # (disease, drug) -> (submitted_at, Future); oldest first
+    return st.session_state.setdefault("prefetch_cache", OrderedDict())
+
+
+def schedule(disease, drugs):
+    """Start loading drugs the annotator is likely to open next."""
+    cache = _session_cache()
+    ttl = float(prefetch_setting("PREFETCH_TTL_S"))
+    now = time.monotonic()
+    pool = get_prefetch_pool()
+    for drug in drugs:
+        if drug is None:
+            continue
+        key = (disease, drug)
+        entry = cache.get(key)
+        if entry and now - entry[0] < ttl:
+            cache.move_to_end(key)
+            continue
+        cache[key] = (now, pool.submit(load_drug_view, disease, drug))
+    while len(cache) > int(prefetch_setting("PREFETCH_CACHE_SIZE")):
+        cache.popitem(last=False)
+
+
+def get(disease, drug):
+    """The drug's view from the prefetch cache if it is fresh, otherwise a direct load.
+
+    A prefetch that is still in flight is waited for rather than duplicated.
+    The document itself is re-read from the shared read cache, which other
+    sessions' writes keep current; the rendered panels are what is kept here.
+    """
+    cache = _session_cache()
+    entry = cache.get((disease, drug))
+    if entry and time.monotonic() - entry[0] < float(prefetch_setting("PREFETCH_TTL_S")):
+        try:
+            view = entry[1].result()
+            return {"doc": load_drug(disease, drug), "references_md": copy.deepcopy(view["references_md"])}
+        except Exception:
+            # fall back to a normal read; the error surfaces there if it persists
+            cache.pop((disease, drug), None)
+    # panels of the current drug stay lazy; they render when opened
+    view = load_drug_view(disease, drug, with_references=False)
+    cache[(disease, drug)] = (time.monotonic(), _done(view))
+    return copy.deepcopy(view)
+
+
+def invalidate(disease, drug):
+    """Forget a drug after this session changed it."""
+    _session_cache().pop((disease, drug), None)
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+READ_CACHE_DEFAULTS = {
+    # drugs whose pre-annotation content and answers are kept; 0 disables the cache
+    "READ_CACHE_DRUGS": 5000,
+    # per-disease drug indexes kept
+    "READ_CACHE_DISEASES": 64,
+    # answers and drug indexes are re-read after this long, to pick up
+    # writes made by other processes; writes from this one evict at once
+    "READ_CACHE_TTL_S": 10,
+}
+
+
+def read_cache_setting(key):
+    return st.secrets.get(key, READ_CACHE_DEFAULTS[key])
+
+
+class ReadCache:
+    """Thread-safe LRU of loaded values, optionally expiring after ttl seconds.
+
+    A load that is still running when its key is invalidated is not
+    stored, so a slow read cannot put back what a write just replaced.
+    None results are never cached.
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (loaded_at, value); oldest first
+        self._entries = OrderedDict()
+        # key -> token of the load in flight
+        self._loading = {}
+
+    def get(self, key, load):
+        if self.size <= 0:
+            return load()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            token = self._loading[key] = object()
+        loaded_at = time.monotonic()
+        try:
+            value = load()
+        except BaseException:
+            with self._lock:
+                if self._loading.get(key) is token:
+                    del self._loading[key]
+            raise
+        with self._lock:
+            if self._loading.get(key) is token:
+                del self._loading[key]
+                if value is not None:
+                    self._entries[key] = (loaded_at, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._loading.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry, and every load in flight, whose key matches."""
+        with self._lock:
+            for entries in (self._entries, self._loading):
+                for key in [key for key in entries if predicate(key)]:
+                    del entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def read_caches():
+    """The process-wide caches, created from settings on first use.
+
+    "content": (disease, drug) -> pre-annotation part of the document, kept until evicted
+    "answers": (disease, drug) -> answer fields and source_hash, with the TTL
+    "index": disease -> load_drug_index() result, with the TTL
+    """
+    with _caches_lock:
+        if not _caches:
+            drugs = int(read_cache_setting("READ_CACHE_DRUGS"))
+            ttl = float(read_cache_setting("READ_CACHE_TTL_S"))
+            _caches.update({
+                "content": ReadCache(drugs),
+                "answers": ReadCache(drugs, ttl),
+                "index": ReadCache(int(read_cache_setting("READ_CACHE_DISEASES")) if drugs else 0, ttl),
+            })
+        return _caches
+
+
+def invalidate_drug(disease, drug, content=False):
+    """Forget a drug's answers (and with content, its pre-annotation part) and its disease index."""
+    caches = read_caches()
+    caches["answers"].invalidate((disease, drug))
+    if content:
+        caches["content"].invalidate((disease, drug))
+    caches["index"].invalidate(disease)
+
+
+def invalidate_disease(disease):
+    """Forget everything cached for a disease key, e.g. after it was re-ingested."""
+    caches = read_caches()
+    for name in ("content", "answers"):
+        caches[name].invalidate_where(lambda key: key[0] == disease)
+    caches["index"].invalidate(disease)
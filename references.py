@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from store import load_references
+
+BRACKET_URL = re.compile(r"\[(https?://[^\]]+)\]")
+TRIAL_URL = re.compile(r"clinicaltrials\.gov/(?:study|ct2/show)/(NCT\d+)", re.IGNORECASE)
+PUBMED_URL = re.compile(r"pubmed\.ncbi\.nlm\.nih\.gov/(\d+)", re.IGNORECASE)
+
+NO_CLINICAL_TRIALS = "No clinical trial references found."
+NO_LITERATURE = "No literature references found."
+
+# rendered references kept in memory; trials repeat across many drugs
+REFERENCE_CACHE_SIZE = 4096
+
+logger = logging.getLogger("kgxllm.references")
+
+# reference id -> rendered markdown, shared by every session
+_RESOLVED = OrderedDict()
+_RESOLVED_SIZE = 20000
+_RESOLVED_LOCK = threading.Lock()
+
+
+def bracket_url_to_md(text):
+    if text is None:
+        return ""
+    return BRACKET_URL.sub(r"<\1>", str(text))
+
+
+def trial_id(ref):
+    """NCT id of a clinical-trial dict; the data uses both nct_id and NCTID."""
+    summary = ref.get("study_summary")
+    summary = summary if isinstance(summary, dict) else {}
+    return (
+        ref.get("nct_id") or ref.get("NCTID")
+        or summary.get("nct_id") or summary.get("NCTID") or ""
+    )
+
+
+def _format_trial(ref):
+    summary = ref.get("study_summary")
+    summary = summary if isinstance(summary, dict) else {}
+    title = summary.get("title") or ref.get("title", "")
+    nct = trial_id(ref)
+    if nct:
+        return f"**{title}** — [{nct}](https://clinicaltrials.gov/study/{nct})"
+    return f"**{title}**"
+
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def _format_cached(kind, key):
+    if kind == "str":
+        return bracket_url_to_md(key)
+    return _format_trial(json.loads(key))
+
+
+def format_reference(ref):
+    """Markdown for one reference, memoized by its content."""
+    if isinstance(ref, str):
+        return _format_cached("str", ref)
+    if isinstance(ref, dict):
+        return _format_cached("dict", json.dumps(ref, sort_keys=True, default=str))
+    return ""
+
+
+def render_references(refs, empty_message):
+    """Markdown bullet list for a list of references."""
+    if not refs:
+        return empty_message
+    return "\n".join(f"- {format_reference(ref)}" for ref in refs)
+
+
+def reference_id(ref):
+    """Key for the shared references collection.
+
+    Clinical trials are keyed by NCT id and PubMed articles by "PMID:<id>",
+    whether they come as dicts or "title [url]" strings, followed by a hash
+    of the reference itself: the same trial cited with different text gets
+    one document per version, so every drug shows the text it was ingested
+    with. Anything else is keyed by the content hash alone.
+    """
+    canonical = json.dumps(ref, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+    if isinstance(ref, dict):
+        nct = trial_id(ref)
+        if nct:
+            return f"{nct.upper()}#{digest[:16]}"
+    else:
+        text = str(ref)
+        match = TRIAL_URL.search(text)
+        if match:
+            return f"{match.group(1).upper()}#{digest[:16]}"
+        match = PUBMED_URL.search(text)
+        if match:
+            return f"PMID:{match.group(1)}#{digest[:16]}"
+    return "sha1:" + digest
+
+
+def extract_references(record):
+    """Replace inline reference lists with id lists.
+
+    Returns the slimmed record and the reference documents to store, each
+    {"_id": id, "kind": ..., "ref": original, "md": rendered line}.
+    """
+    record = dict(record)
+    ref_docs = {}
+    for question, field, kind in (
+        ("Q1", "clinicaltrial_references", "clinicaltrial"),
+        ("Q2", "literature_references", "literature"),
+    ):
+        section = record.get(question)
+        if not isinstance(section, dict) or field not in section:
+            continue
+        section = dict(section)
+        ids = []
+        for ref in section.pop(field) or []:
+            ref_id = reference_id(ref)
+            ids.append(ref_id)
+            ref_docs.setdefault(ref_id, {"_id": ref_id, "kind": kind, "ref": ref, "md": format_reference(ref)})
+        section[f"{kind}_ref_ids"] = ids
+        record[question] = section
+    return record, list(ref_docs.values())
+
+
+def resolve_references(ids):
+    """{id: markdown} for the given ids; cache misses are fetched in one query."""
+    with _RESOLVED_LOCK:
+        found = {ref_id: _RESOLVED[ref_id] for ref_id in ids if ref_id in _RESOLVED}
+    missing = [ref_id for ref_id in dict.fromkeys(ids) if ref_id not in found]
+    if missing:
+        fetched = {doc["_id"]: doc["md"] for doc in load_references(missing)}
+        found.update(fetched)
+        with _RESOLVED_LOCK:
+            _RESOLVED.update(fetched)
+            while len(_RESOLVED) > _RESOLVED_SIZE:
+                _RESOLVED.popitem(last=False)
+    return found
+
+
+def forget_references(ids):
+    """Drop references from the shared cache, e.g. after ingest saved them again."""
+    with _RESOLVED_LOCK:
+        for ref_id in ids:
+            _RESOLVED.pop(ref_id, None)
+
+
+def render_reference_ids(ids, empty_message):
+    if not ids:
+        return empty_message
+    resolved = resolve_references(ids)
+    missing = [ref_id for ref_id in ids if ref_id not in resolved]
+    if missing:
+        logger.warning("references not found: %s", ", ".join(missing))
+    lines = [f"- {resolved[ref_id]}" for ref_id in ids if ref_id in resolved]
+    return "\n".join(lines) if lines else empty_message
+
+
+# panel kind -> (question section, inline field, message when empty)
+PANELS = {
+    "clinicaltrial": ("Q1", "clinicaltrial_references", NO_CLINICAL_TRIALS),
+    "literature": ("Q2", "literature_references", NO_LITERATURE),
+}
+
+
+def panel_md(doc, kind):
+    """Markdown for one reference panel ("clinicaltrial" or "literature") of a drug.
+
+    Uses the shared reference ids when present and falls back to inline
+    references for documents that predate the references collection.
+    """
+    question, inline_field, empty_message = PANELS[kind]
+    section = doc.get(question) if isinstance(doc.get(question), dict) else {}
+    if f"{kind}_ref_ids" in section:
+        return render_reference_ids(section[f"{kind}_ref_ids"], empty_message)
+    if doc.get("references_md"):
+        return doc["references_md"][kind]
+    return render_references(section.get(inline_field), empty_message)
+
+
+def drug_references_md(doc):
+    """Markdown for both reference panels, resolved with a single lookup."""
+    ids = []
+    for kind, (question, _, _) in PANELS.items():
+        section = doc.get(question) if isinstance(doc.get(question), dict) else {}
+        ids.extend(section.get(f"{kind}_ref_ids") or [])
+    resolve_references(ids)
+    return {kind: panel_md(doc, kind) for kind in PANELS}
@@ -0,0 +1,54 @@
+import tomllib
+
+import streamlit as st
+
+from ingest import disease_copies
+
+REGISTRY_DEFAULTS = {
+    "DISEASE_REGISTRY": "diseases.toml",
+}
+
+
+def read_registry(path):
+    """{disease key: entry} for every disease and annotator copy listed in a registry file.
+
+    Each entry is {"key", "name", "annotator", "title"}, in file order. Keys
+    are built like ingest builds them, so they match the stored copies.
+    """
+    with open(path, "rb") as file:
+        config = tomllib.load(file)
+    registry = {}
+    for disease in config.get("disease", []):
+        title = disease.get("title") or disease["name"].title()
+        for key, name, annotator in disease_copies(disease["name"], disease.get("annotators")):
+            if key in registry:
+                raise ValueError(f"{path}: {key!r} is listed twice")
+            registry[key] = {"key": key, "name": name, "annotator": annotator, "title": title}
+    return registry
+
+
+def registry_jobs(registry):
+    """(disease, annotators) ingest jobs that create every copy in the registry."""
+    jobs = {}
+    for entry in registry.values():
+        annotators = jobs.setdefault(entry["name"], [])
+        if entry["annotator"]:
+            annotators.append(entry["annotator"])
+    return [(name, annotators or None) for name, annotators in jobs.items()]
+
+
+@st.cache_resource(show_spinner=False)
+def get_registry():
+    """The registry named by DISEASE_REGISTRY, read once per server process."""
+    return read_registry(st.secrets.get("DISEASE_REGISTRY", REGISTRY_DEFAULTS["DISEASE_REGISTRY"]))
+
+
+def disease_title(disease, registry=None):
+    """Registry title for a disease key or source disease name; None if it is not listed."""
+    registry = get_registry() if registry is None else registry
+    if disease in registry:
+        return registry[disease]["title"]
+    for entry in registry.values():
+        if entry["name"] == disease:
+            return entry["title"]
+    return None
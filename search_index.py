@@ -0,0 +1,327 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import streamlit as st
+
+from ingest import SOURCE_DIR, iter_records
+from store import iter_annotations, record_fingerprint
+
+SEARCH_DEFAULTS = {
+    "SEARCH_INDEX_PATH": "kgxllm-search.sqlite3",
+}
+
+MERGED_DIR = "drug_results"
+
+# entries hold one searchable text each (a trial, a reference, a note, ...);
+# entries_fts indexes their text, with prefix indexes for "inhib*" queries.
+# A unit is everything indexed for one drug from one source, and is
+# rewritten only when its fingerprint changes; a scope is the file (or the
+# database) the unit came from, and its files row lets an unchanged file be
+# skipped without reading it.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    unit TEXT NOT NULL,
+    source TEXT NOT NULL,
+    disease TEXT,
+    parent_disease TEXT,
+    annotator TEXT,
+    drug TEXT,
+    field TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_unit ON entries (unit);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    text, content='entries', content_rowid='id', prefix='2 3 4'
+);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+
+CREATE TABLE IF NOT EXISTS units (
+    unit TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS units_scope ON units (scope);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+"""
+
+STORE_SCOPE = "store"
+
+NOTES_PROJECTION = {"_id": 0, "disease": 1, "parent_disease": 1, "annotator": 1, "drug": 1, "Q4_notes": 1}
+
+
+def index_path():
+    return st.secrets.get("SEARCH_INDEX_PATH", SEARCH_DEFAULTS["SEARCH_INDEX_PATH"])
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or index_path(), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def file_disease(path, suffix):
+    return os.path.basename(path)[:-len(suffix)].lower()
+
+
+def pre_annotated_entries(record):
+    """(field, text) pairs of one pre-annotated record: trials, literature and any notes."""
+    entries = [("drug", f"{record.get('drug', '')} {record.get('disease') or ''}".strip())]
+    q1 = record.get("Q1") if isinstance(record.get("Q1"), dict) else {}
+    for ref in q1.get("clinicaltrial_references") or []:
+        if not isinstance(ref, dict):
+            continue
+        summary = ref.get("study_summary") if isinstance(ref.get("study_summary"), dict) else {}
+        treatments = summary.get("drug_for_treatment") or []
+        parts = [
+            summary.get("title") or ref.get("title"),
+            summary.get("NCTID") or summary.get("nct_id") or ref.get("nct_id"),
+            summary.get("indication"),
+            summary.get("result_summary_sentence"),
+            ", ".join(treatments) if isinstance(treatments, list) else treatments,
+        ]
+        entries.append(("trial", " — ".join(str(part) for part in parts if part)))
+    q2 = record.get("Q2") if isinstance(record.get("Q2"), dict) else {}
+    for ref in q2.get("literature_references") or []:
+        entries.append(("literature", ref if isinstance(ref, str) else json.dumps(ref, ensure_ascii=False)))
+    if record.get("Q4_notes"):
+        entries.append(("notes", record["Q4_notes"]))
+    return entries
+
+
+def merged_entries(record):
+    """(field, text) pairs of one drug_results/*.merged.jsonl record: rationale and evidence."""
+    entries = [("rationale", bullet) for bullet in record.get("rationale_bullets") or [] if bullet]
+    questionnaire = record.get("questionnaire") if isinstance(record.get("questionnaire"), dict) else {}
+    for ref in questionnaire.get("Q8_supporting_evidence_references") or []:
+        if isinstance(ref, str) and ref:
+            entries.append(("evidence", ref))
+    return entries
+
+
+def _write_unit(conn, unit, scope, fingerprint, rows, known, counts):
+    """Replace one unit's entries unless its fingerprint is unchanged."""
+    if known.pop(unit, None) == fingerprint:
+        counts["unchanged"] += 1
+        return
+    conn.execute("DELETE FROM entries WHERE unit = ?", (unit,))
+    conn.executemany(
+        "INSERT INTO entries (unit, source, disease, parent_disease, annotator, drug, field, text)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(unit, *row) for row in rows]
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO units (unit, scope, fingerprint) VALUES (?, ?, ?)",
+        (unit, scope, fingerprint)
+    )
+    counts["indexed"] += 1
+
+
+def _drop_units(conn, units, counts):
+    """Remove units that are no longer in their source."""
+    for unit in units:
+        conn.execute("DELETE FROM entries WHERE unit = ?", (unit,))
+        conn.execute("DELETE FROM units WHERE unit = ?", (unit,))
+        counts["removed"] += 1
+
+
+def _known_units(conn, scope):
+    return {
+        row["unit"]: row["fingerprint"]
+        for row in conn.execute("SELECT unit, fingerprint FROM units WHERE scope = ?", (scope,))
+    }
+
+
+def index_file(conn, path, source, suffix, extract, counts):
+    """Index the records of one JSONL file, skipping it if it has not changed since last time."""
+    stat = os.stat(path)
+    seen = conn.execute("SELECT mtime, size FROM files WHERE path = ?", (path,)).fetchone()
+    if seen and seen["mtime"] == stat.st_mtime and seen["size"] == stat.st_size:
+        counts["files_skipped"] += 1
+        return
+    disease = file_disease(path, suffix)
+    known = _known_units(conn, path)
+    with conn:
+        for _, record, _ in iter_records(path):
+            if record is None or not record.get("drug"):
+                continue
+            drug = record["drug"]
+            rows = [
+                (source, disease, disease, None, drug, field, text)
+                for field, text in extract(record)
+            ]
+            _write_unit(conn, f"{source}:{disease}:{drug}", path, record_fingerprint(record), rows, known, counts)
+        _drop_units(conn, known, counts)
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, mtime, size) VALUES (?, ?, ?)",
+            (path, stat.st_mtime, stat.st_size)
+        )
+
+
+def drop_missing_files(conn, seen, counts):
+    """Remove the units and file records of source files this build did not find."""
+    stale = [
+        row["scope"] for row in conn.execute("SELECT DISTINCT scope FROM units")
+        if row["scope"] != STORE_SCOPE and row["scope"] not in seen
+    ]
+    with conn:
+        for scope in stale:
+            _drop_units(conn, list(_known_units(conn, scope)), counts)
+        for row in conn.execute("SELECT path FROM files").fetchall():
+            if row["path"] not in seen:
+                conn.execute("DELETE FROM files WHERE path = ?", (row["path"],))
+
+
+def index_notes(conn, counts, batch_size=1000):
+    """Index annotator notes from the annotation store, one unit per drug copy with notes."""
+    known = _known_units(conn, STORE_SCOPE)
+    with conn:
+        for doc in iter_annotations(projection=NOTES_PROJECTION, batch_size=batch_size):
+            notes = (doc.get("Q4_notes") or "").strip()
+            if not notes:
+                continue
+            rows = [("notes", doc["disease"], doc.get("parent_disease"), doc.get("annotator"), doc["drug"], "notes", notes)]
+            fingerprint = hashlib.sha1(notes.encode("utf-8")).hexdigest()
+            _write_unit(conn, f"notes:{doc['disease']}:{doc['drug']}", STORE_SCOPE, fingerprint, rows, known, counts)
+        _drop_units(conn, known, counts)
+
+
+def build_index(path=None, source_dir=SOURCE_DIR, merged_dir=MERGED_DIR, include_store=True):
+    """Bring the search index up to date; only new or changed drugs are rewritten.
+
+    Files that were deleted or renamed since the last build are dropped
+    from the index. Returns counts of indexed, unchanged and removed units
+    and skipped files.
+    """
+    counts = {"indexed": 0, "unchanged": 0, "removed": 0, "files_skipped": 0}
+    conn = connect(path)
+    try:
+        seen = set()
+        for file in sorted(glob.glob(os.path.join(source_dir, "*.pre_annotated.jsonl"))):
+            index_file(conn, file, "pre_annotated", ".pre_annotated.jsonl", pre_annotated_entries, counts)
+            seen.add(file)
+        for file in sorted(glob.glob(os.path.join(merged_dir, "*.merged.jsonl"))):
+            index_file(conn, file, "merged", ".merged.jsonl", merged_entries, counts)
+            seen.add(file)
+        drop_missing_files(conn, seen, counts)
+        if include_store:
+            index_notes(conn, counts)
+        conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, "word*" matches a prefix.
+
+    Words are quoted, so punctuation in drug names (ABT-414) is not read as
+    query syntax.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', "")
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search(text, diseases=None, annotators=None, limit=50, path=None):
+    """Best matches for text, optionally limited to parent diseases / disease keys and annotators.
+
+    Returns [{"source", "disease", "parent_disease", "annotator", "drug", "field", "snippet"}, ...]
+    ranked by bm25.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    where = ["entries_fts MATCH ?"]
+    params = [query]
+    if diseases:
+        marks = ", ".join("?" * len(diseases))
+        where.append(f"(e.parent_disease IN ({marks}) OR e.disease IN ({marks}))")
+        params.extend([*diseases, *diseases])
+    if annotators:
+        where.append(f"e.annotator IN ({', '.join('?' * len(annotators))})")
+        params.extend(annotators)
+    conn = connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT e.source, e.disease, e.parent_disease, e.annotator, e.drug, e.field,"
+            " snippet(entries_fts, 0, '**', '**', '…', 16) AS snippet"
+            " FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid"
+            f" WHERE {' AND '.join(where)} ORDER BY bm25(entries_fts) LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+    except sqlite3.OperationalError as exc:
+        raise ValueError(f"Cannot search for {text!r}: {exc}") from exc
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def index_facets(path=None):
+    """Parent diseases and annotators present in the index, for filter pickers."""
+    conn = connect(path)
+    try:
+        diseases = [row[0] for row in conn.execute(
+            "SELECT DISTINCT parent_disease FROM entries WHERE parent_disease IS NOT NULL ORDER BY 1")]
+        annotators = [row[0] for row in conn.execute(
+            "SELECT DISTINCT annotator FROM entries WHERE annotator IS NOT NULL ORDER BY 1")]
+    finally:
+        conn.close()
+    return diseases, annotators
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search drugs, references, rationales and annotator notes, or update the search index."
+    )
+    parser.add_argument("query", nargs="?", help='words to find; end a word with * for a prefix, e.g. "PI3K inhib*"')
+    parser.add_argument("--build", action="store_true", help="update the index from the source files and database")
+    parser.add_argument("--no-store", action="store_true", help="with --build, skip annotator notes in the database")
+    parser.add_argument("--source-dir", default=SOURCE_DIR)
+    parser.add_argument("--merged-dir", default=MERGED_DIR)
+    parser.add_argument("--disease", action="append", dest="diseases",
+                        help="parent disease or disease key to search, e.g. glioblastoma (repeatable)")
+    parser.add_argument("--annotator", action="append", dest="annotators",
+                        help="annotator whose notes to search (repeatable)")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--index", help=f"index file (default {SEARCH_DEFAULTS['SEARCH_INDEX_PATH']})")
+    args = parser.parse_args()
+    if not args.build and not args.query:
+        parser.error("give a query or --build")
+
+    if args.build:
+        started = time.perf_counter()
+        counts = build_index(args.index, args.source_dir, args.merged_dir, include_store=not args.no_store)
+        print(f"Indexed {counts['indexed']} drugs, {counts['unchanged']} unchanged, {counts['removed']} removed, "
+              f"{counts['files_skipped']} files unchanged ({time.perf_counter() - started:.2f}s)")
+    if args.query:
+        started = time.perf_counter()
+        results = search(args.query, args.diseases, args.annotators, args.limit, args.index)
+        elapsed = (time.perf_counter() - started) * 1000
+        for row in results:
+            where = row["disease"] + (f" ({row['annotator']})" if row["annotator"] else "")
+            print(f"{where:<24} {row['drug']:<28} {row['field']:<11} {row['snippet']}")
+        print(f"{len(results)} results in {elapsed:.1f} ms")
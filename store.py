@@ -0,0 +1,281 @@
+import copy
+import datetime
+import hashlib
+import importlib
+import json
+
+import streamlit as st
+
+from readcache import invalidate_disease, invalidate_drug, read_caches
+
+# STORAGE_BACKEND in secrets picks the module that holds the data:
+# "mongo" (default, needs MONGO_URI) or "sqlite" (a local file, SQLITE_PATH)
+BACKENDS = {
+    "mongo": "store_mongo",
+    "sqlite": "store_sqlite",
+}
+
+# applied once when a drug is written, never on the request path
+DRUG_DEFAULTS = {
+    "completed": False,
+    # bumped by every answer write, see bulk_set_drug_fields
+    "version": 0,
+}
+
+# written by annotators; re-ingesting a drug never overwrites these
+ANSWER_FIELDS = (
+    "completed", "Q1.selection", "Q2.selection", "Q3_interest", "Q4_notes",
+    "version", "updated_at", "updated_by",
+)
+
+# answer fields the pipeline pre-fills. Ingest keeps the pipeline's value
+# under "prefill" too, and re-ingest refreshes an answer only while it still
+# equals that value and the drug is not completed
+PREFILLED_ANSWERS = ("Q1.selection", "Q2.selection")
+
+
+def backend():
+    name = st.secrets.get("STORAGE_BACKEND", "mongo")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; use one of {', '.join(BACKENDS)}")
+    return importlib.import_module(BACKENDS[name])
+
+
+def record_fingerprint(record):
+    """Stable hash of a pre-annotated record, used to skip unchanged drugs."""
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def drug_doc(disease, record, order, parent_disease=None, annotator=None, source_hash=None, prefill=True):
+    """Build the stored document for one drug record of a disease.
+
+    With prefill, the record's PREFILLED_ANSWERS are also kept under
+    "prefill", as the pipeline values the answers started from.
+    """
+    doc = {**DRUG_DEFAULTS, **record, "source_hash": source_hash or record_fingerprint(record)}
+    if prefill:
+        doc["prefill"] = {}
+        for field in PREFILLED_ANSWERS:
+            value, found = get_dotted(record, field)
+            if found:
+                set_dotted(doc["prefill"], field, value)
+    # the record's own "disease" is free text ("pancreatic cancer")
+    doc["source_disease"] = doc.pop("disease", None)
+    doc.update({
+        "disease": disease,
+        "parent_disease": parent_disease or disease,
+        "annotator": annotator,
+        "drug": record.get("drug"),
+        "order": order,
+    })
+    return doc
+
+
+def utc_now():
+    """ISO-8601 UTC timestamp, stored the same way by every backend."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+def get_dotted(doc, key):
+    """(doc["Q1"]["selection"], True) for key "Q1.selection", or (None, False) if absent."""
+    for part in key.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def set_dotted(doc, key, value):
+    """doc["Q1"]["selection"] = value for key "Q1.selection"."""
+    *parents, last = key.split(".")
+    for part in parents:
+        child = doc.get(part)
+        if not isinstance(child, dict):
+            child = doc[part] = {}
+        doc = child
+    doc[last] = value
+
+
+def split_answers(doc):
+    """(document without ANSWER_FIELDS, {field: value} of the ones it has)."""
+    content = copy.deepcopy(doc)
+    answers = {}
+    for field in ANSWER_FIELDS:
+        value, found = get_dotted(doc, field)
+        if found:
+            answers[field] = value
+            *parents, last = field.split(".")
+            parent = get_dotted(content, ".".join(parents))[0] if parents else content
+            parent.pop(last)
+    return content, answers
+
+
+# the interface every backend implements; see store_mongo.py for the reference version.
+# Reads of drugs and drug indexes go through the process-wide caches in
+# readcache.py; every write below evicts what it changed.
+
+
+def is_transient_error(exc):
+    """Whether a failed write is worth retrying as is: the database was unreachable, busy or timed out."""
+    return backend().is_transient_error(exc)
+
+
+def warm_up():
+    """Open the connection before the first page needs it."""
+    backend().warm_up()
+
+
+def ensure_indexes():
+    backend().ensure_indexes()
+
+
+def write_drugs(copies, batch):
+    """Replace a batch of [(order, record, source_hash), ...] in every (disease, parent, annotator) copy."""
+    backend().write_drugs(copies, batch)
+    for disease, _, _ in copies:
+        invalidate_disease(disease)
+
+
+def load_fingerprints(disease):
+    """{drug: {"source_hash": ..., "order": ...}} for every stored drug of a disease."""
+    return backend().load_fingerprints(disease)
+
+
+def sync_drugs(copies, batch, existing):
+    """Write only new or changed drugs, keeping ANSWER_FIELDS; returns new/changed/unchanged counts.
+
+    PREFILLED_ANSWERS of a changed drug are refreshed too while they still
+    hold the pipeline value they were last ingested with.
+    """
+    counts = backend().sync_drugs(copies, batch, existing)
+    for disease, _, _ in copies:
+        invalidate_disease(disease)
+    return counts
+
+
+def finish_disease(disease, drugs, parent_disease=None, annotator=None, prune=True):
+    """Record the disease summary; with prune, drop drugs no longer in the source."""
+    backend().finish_disease(disease, drugs, parent_disease, annotator, prune)
+    invalidate_disease(disease)
+
+
+def load_drug_index(disease):
+    """[{"drug", "order", "completed", "Q1": {"selection"}}, ...] in drug order; empty if the disease is unknown.
+
+    Served from the shared cache; the entries are shared too, so treat them as read-only.
+    """
+    # an unknown disease (empty index) is not cached, so it shows up as soon as it is ingested
+    index = read_caches()["index"].get(disease, lambda: backend().load_drug_index(disease) or None)
+    return list(index or [])
+
+
+def iter_annotations(parent_diseases=None, annotators=None, projection=None, batch_size=1000):
+    """Stream drug documents ordered by disease key then drug order."""
+    return backend().iter_annotations(parent_diseases, annotators, projection, batch_size)
+
+
+def _load_content(disease, drug):
+    doc = backend().load_drug(disease, drug)
+    return split_answers(doc)[0] if doc is not None else None
+
+
+def _load_answers(disease, drug):
+    doc = backend().load_answers(disease, drug)
+    if doc is None:
+        return None
+    return {"source_hash": doc.get("source_hash"), "fields": split_answers(doc)[1]}
+
+
+def load_drug(disease, drug):
+    """Fetch one drug's document, or None.
+
+    The pre-annotation part never changes after ingest and is cached until
+    evicted; the answers are cached separately with a TTL. Each call gets
+    its own copy.
+    """
+    caches = read_caches()
+    key = (disease, drug)
+    content = caches["content"].get(key, lambda: _load_content(disease, drug))
+    if content is None:
+        return None
+    answers = caches["answers"].get(key, lambda: _load_answers(disease, drug))
+    if answers is None or answers["source_hash"] != content.get("source_hash"):
+        # removed or re-ingested by another process since content was cached
+        invalidate_drug(disease, drug, content=True)
+        return backend().load_drug(disease, drug)
+    doc = copy.deepcopy(content)
+    for field, value in answers["fields"].items():
+        set_dotted(doc, field, value)
+    return doc
+
+
+def load_answers(disease, drug):
+    """A drug's ANSWER_FIELDS and source_hash, without the pre-annotation payload."""
+    return backend().load_answers(disease, drug)
+
+
+def set_completed(disease, drug, completed=True):
+    """Flip a drug's completed flag and the disease's completed_count; returns whether it changed."""
+    changed = backend().set_completed(disease, drug, completed)
+    invalidate_drug(disease, drug)
+    return changed
+
+
+def bulk_set_drug_fields(updates):
+    """Apply [(disease, drug, fields, version, owner), ...] in one batch; returns the conflicts.
+
+    An update with a version only lands if the drug is still at that
+    version, or was last written by the same owner (the session that
+    based its edits on it). Landed answer writes bump version and stamp
+    updated_at / updated_by; "completed" is applied unconditionally and
+    leaves version alone. Returns [(disease, drug, owner), ...] for the
+    updates that were rejected.
+    """
+    conflicts = backend().bulk_set_drug_fields(updates)
+    for disease, drug, _, _, _ in updates:
+        invalidate_drug(disease, drug)
+    return conflicts
+
+
+def next_pending(disease, after_order=-1):
+    """{"drug", "order"} of the first incomplete drug after after_order, wrapping around; None if all are done.
+
+    Answered from the (disease, completed, order) index, so it costs the
+    same however many drugs are already complete.
+    """
+    return backend().next_pending(disease, after_order)
+
+
+def load_cursor(disease, email):
+    """The drug an annotator last had open on a disease, or None."""
+    return backend().load_cursor(disease, email)
+
+
+def save_cursor(disease, email, drug):
+    """Remember the drug an annotator has open, to resume there next session."""
+    backend().save_cursor(disease, email, drug)
+
+
+def load_disease_summaries():
+    """Every disease copy with parent_disease, annotator, drug_count and completed_count."""
+    return backend().load_disease_summaries()
+
+
+def load_status_counts(field="Q1.selection"):
+    """{disease: {answer: drugs}} for one answer field."""
+    return backend().load_status_counts(field)
+
+
+def save_references(ref_docs):
+    """Insert shared reference documents that are not stored yet.
+
+    Reference ids include a hash of their content, so a stored document
+    never needs updating.
+    """
+    backend().save_references(ref_docs)
+
+
+def load_references(ids):
+    """[{"_id", "md"}, ...] for the given reference ids."""
+    return backend().load_references(ids)
@@ -0,0 +1,397 @@
+import uuid
+
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    ExecutionTimeout,
+    PyMongoError,
+    WTimeoutError,
+)
+
+from db import get_client, get_db, supports_transactions
+from store import ANSWER_FIELDS, PREFILLED_ANSWERS, drug_doc, get_dotted, utc_now
+
+# MongoDB storage backend; store.py documents the interface
+
+# one document per (disease, drug); "disease" is the per-annotator key,
+# e.g. "glioblastoma_betty", and "order" keeps the original drug order
+ANNOTATION_INDEXES = [
+    ([("disease", ASCENDING), ("drug", ASCENDING)], {"unique": True}),
+    ([("disease", ASCENDING), ("order", ASCENDING)], {}),
+    ([("disease", ASCENDING), ("completed", ASCENDING), ("order", ASCENDING)], {}),
+    ([("parent_disease", ASCENDING), ("annotator", ASCENDING), ("drug", ASCENDING)], {}),
+]
+
+
+def diseases_collection():
+    return get_db()["diseases"]
+
+
+def annotations_collection():
+    return get_db()["annotations"]
+
+
+def meta_collection():
+    return get_db()["meta"]
+
+
+def references_collection():
+    return get_db()["references"]
+
+
+def users_collection():
+    return get_db()["users"]
+
+
+def is_transient_error(exc):
+    # ConnectionFailure covers AutoReconnect, NetworkTimeout and server selection timeouts
+    if isinstance(exc, (ConnectionFailure, ExecutionTimeout, WTimeoutError)):
+        return True
+    return isinstance(exc, PyMongoError) and exc.has_error_label("RetryableWriteError")
+
+
+def warm_up():
+    # opens the pooled client (db.get_client) before the first page needs it
+    get_db()
+
+
+def ensure_indexes():
+    collection = annotations_collection()
+    for keys, options in ANNOTATION_INDEXES:
+        collection.create_index(keys, **options)
+    diseases_collection().create_index("disease", unique=True)
+    users_collection().create_index([("email", ASCENDING), ("disease", ASCENDING)], unique=True)
+
+
+def write_drugs(copies, batch):
+    """Replace a batch of [(order, record, source_hash), ...] in every copy.
+
+    copies is a list of (disease, parent_disease, annotator) tuples, one per
+    annotator copy of the same source disease. Existing answers are lost;
+    see sync_drugs for the incremental version.
+    """
+    requests = [
+        ReplaceOne(
+            {"disease": disease, "drug": record.get("drug")},
+            drug_doc(disease, record, order, parent_disease, annotator, source_hash),
+            upsert=True
+        )
+        for disease, parent_disease, annotator in copies
+        for order, record, source_hash in batch
+    ]
+    if requests:
+        annotations_collection().bulk_write(requests, ordered=False)
+
+
+def load_fingerprints(disease):
+    """{drug: {"source_hash": ..., "order": ..., "prefill": ...}} for every stored drug of a disease."""
+    cursor = annotations_collection().find(
+        {"disease": disease},
+        {"_id": 0, "drug": 1, "source_hash": 1, "order": 1, "prefill": 1}
+    )
+    return {doc["drug"]: doc for doc in cursor}
+
+
+def preannotation_fields(doc):
+    """Flatten a drug document into $set paths, leaving out ANSWER_FIELDS."""
+    fields = {}
+    for key, value in doc.items():
+        if key in ANSWER_FIELDS:
+            continue
+        if isinstance(value, dict) and any(f.startswith(f"{key}.") for f in ANSWER_FIELDS):
+            for sub_key, sub_value in value.items():
+                if f"{key}.{sub_key}" not in ANSWER_FIELDS:
+                    fields[f"{key}.{sub_key}"] = sub_value
+        else:
+            fields[key] = value
+    return fields
+
+
+def sync_drugs(copies, batch, existing):
+    """Write only new or changed drugs of a batch to every copy.
+
+    existing maps each copy's disease key to load_fingerprints() output. New
+    drugs are inserted whole; drugs whose source_hash changed get their
+    pre-annotation fields refreshed while ANSWER_FIELDS are kept, except
+    PREFILLED_ANSWERS that still hold the pipeline value last ingested
+    (stored under "prefill") on a drug that is not completed; unchanged
+    drugs cost nothing. Returns {"new": n, "changed": n, "unchanged": n}.
+    """
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    requests = []
+    for disease, parent_disease, annotator in copies:
+        stored = existing.get(disease, {})
+        for order, record, source_hash in batch:
+            drug = record.get("drug")
+            current = stored.get(drug)
+            if current is None:
+                counts["new"] += 1
+                requests.append(ReplaceOne(
+                    {"disease": disease, "drug": drug},
+                    drug_doc(disease, record, order, parent_disease, annotator, source_hash),
+                    upsert=True
+                ))
+            elif current.get("source_hash") != source_hash:
+                counts["changed"] += 1
+                doc = drug_doc(disease, record, order, parent_disease, annotator, source_hash)
+                requests.append(UpdateOne(
+                    {"disease": disease, "drug": drug},
+                    {"$set": preannotation_fields(doc)}
+                ))
+                for field in PREFILLED_ANSWERS:
+                    previous, known = get_dotted(current.get("prefill") or {}, field)
+                    value, found = get_dotted(doc, field)
+                    if known and found and value != previous:
+                        # only lands while the answer is still the old pipeline value; it
+                        # touches other fields than the update above, so the order does not matter
+                        requests.append(UpdateOne(
+                            {"disease": disease, "drug": drug, field: previous, "completed": {"$ne": True}},
+                            {"$set": {field: value}}
+                        ))
+            else:
+                counts["unchanged"] += 1
+                if current.get("order") != order:
+                    requests.append(UpdateOne({"disease": disease, "drug": drug}, {"$set": {"order": order}}))
+    if requests:
+        annotations_collection().bulk_write(requests, ordered=False)
+    return counts
+
+
+def finish_disease(disease, drugs, parent_disease=None, annotator=None, prune=True):
+    """Record the disease summary; with prune, drop drugs no longer in the source."""
+    collection = annotations_collection()
+    if prune:
+        collection.delete_many({"disease": disease, "drug": {"$nin": list(drugs)}})
+    diseases_collection().update_one(
+        {"disease": disease},
+        {
+            "$set": {
+                "disease": disease,
+                "parent_disease": parent_disease or disease,
+                "annotator": annotator,
+                "drug_count": collection.count_documents({"disease": disease}),
+                "completed_count": collection.count_documents({"disease": disease, "completed": True}),
+                "layout": "annotations",
+            },
+            "$unset": {"drug_map": ""},
+        },
+        upsert=True
+    )
+
+
+def load_drug_index(disease):
+    """Drug names in order with their completed flag and Q1 status, no payloads.
+
+    Returns [{"drug": name, "order": n, "completed": bool, "Q1": {"selection": ...}}, ...]
+    in (disease, order) index order. An empty list means the disease does
+    not exist.
+    """
+    cursor = annotations_collection().find(
+        {"disease": disease},
+        {"_id": 0, "drug": 1, "order": 1, "completed": 1, "Q1.selection": 1}
+    ).sort("order", ASCENDING)
+    return list(cursor)
+
+
+def iter_annotations(parent_diseases=None, annotators=None, projection=None, batch_size=1000):
+    """Stream drug documents, optionally filtered by parent disease and annotator.
+
+    Ordered by disease key then drug order, without loading everything at once.
+    """
+    query = {}
+    if parent_diseases:
+        query["parent_disease"] = {"$in": list(parent_diseases)}
+    if annotators:
+        query["annotator"] = {"$in": list(annotators)}
+    cursor = annotations_collection().find(query, projection or {"_id": 0})
+    return cursor.sort([("disease", ASCENDING), ("order", ASCENDING)]).batch_size(batch_size)
+
+
+def load_drug(disease, drug):
+    """Fetch one drug's document."""
+    return annotations_collection().find_one(
+        {"disease": disease, "drug": drug},
+        {"_id": 0, "write_id": 0}
+    )
+
+
+def load_answers(disease, drug):
+    """Only the answer fields and source_hash of one drug."""
+    return annotations_collection().find_one(
+        {"disease": disease, "drug": drug},
+        {"_id": 0, "source_hash": 1, **{field: 1 for field in ANSWER_FIELDS}}
+    )
+
+
+def _flip_completed(disease, drug, completed, session=None):
+    result = annotations_collection().update_one(
+        {"disease": disease, "drug": drug, "completed": {"$ne": completed}},
+        {"$set": {"completed": completed}},
+        session=session
+    )
+    if result.modified_count:
+        diseases_collection().update_one(
+            {"disease": disease},
+            {"$inc": {"completed_count": 1 if completed else -1}},
+            session=session
+        )
+    return bool(result.modified_count)
+
+
+def recount_completed(disease):
+    """Set the disease's completed_count from the (disease, completed) index."""
+    diseases_collection().update_one(
+        {"disease": disease},
+        {"$set": {"completed_count": annotations_collection().count_documents(
+            {"disease": disease, "completed": True}
+        )}}
+    )
+
+
+def set_completed(disease, drug, completed=True):
+    """Flip a drug's completed flag and move the disease's completed_count with it.
+
+    The update only matches when the flag actually changes, so a retried or
+    replayed call never counts twice. On a replica set both writes run in
+    one transaction. Without transactions a failure between them would lose
+    the increment, so a call that finds the flag already flipped recounts
+    the disease instead. Returns whether the flag changed.
+    """
+    if supports_transactions():
+        with get_client().start_session() as session:
+            return session.with_transaction(lambda s: _flip_completed(disease, drug, completed, s))
+    changed = _flip_completed(disease, drug, completed)
+    if not changed:
+        recount_completed(disease)
+    return changed
+
+
+def bulk_set_drug_fields(updates):
+    """Apply [(disease, drug, fields, version, owner), ...] as one unordered bulk write.
+
+    Answer fields are written only while the drug is at the given version
+    or was last written by owner; each write carries a fresh write_id, and
+    when fewer updates matched than were sent, the write_ids read back tell
+    which ones were rejected. Completion changes are applied one by one
+    through set_completed so the per-disease counters stay exact.
+    Returns [(disease, drug, owner), ...] for the rejected updates.
+    """
+    requests = []
+    sent = []
+    completions = []
+    for disease, drug, fields, version, owner in updates:
+        fields = dict(fields)
+        if "completed" in fields:
+            completions.append((disease, drug, fields.pop("completed")))
+        if not fields:
+            continue
+        query = {"disease": disease, "drug": drug}
+        if version is not None:
+            query["$or"] = [{"version": version}, {"updated_by": owner}]
+        write_id = uuid.uuid4().hex
+        sent.append((disease, drug, owner, write_id))
+        requests.append(UpdateOne(query, {
+            "$set": {**fields, "updated_at": utc_now(), "updated_by": owner, "write_id": write_id},
+            "$inc": {"version": 1},
+        }))
+
+    conflicts = []
+    if requests:
+        result = annotations_collection().bulk_write(requests, ordered=False)
+        if result.matched_count < len(requests):
+            landed = {
+                (doc["disease"], doc["drug"]): doc.get("write_id")
+                for doc in annotations_collection().find(
+                    {"$or": [{"disease": disease, "drug": drug} for disease, drug, _, _ in sent]},
+                    {"_id": 0, "disease": 1, "drug": 1, "write_id": 1}
+                )
+            }
+            # a drug that no longer exists has nothing to conflict with
+            conflicts = [
+                (disease, drug, owner)
+                for disease, drug, owner, write_id in sent
+                if (disease, drug) in landed and landed[(disease, drug)] != write_id
+            ]
+    for disease, drug, completed in completions:
+        set_completed(disease, drug, completed)
+    return conflicts
+
+
+def next_pending(disease, after_order=-1):
+    """First incomplete drug after after_order, from the (disease, completed, order) index."""
+    collection = annotations_collection()
+    for lower in dict.fromkeys((after_order, -1)):
+        doc = collection.find_one(
+            {"disease": disease, "completed": False, "order": {"$gt": lower}},
+            {"_id": 0, "drug": 1, "order": 1},
+            sort=[("order", ASCENDING)]
+        )
+        if doc:
+            return doc
+    return None
+
+
+def load_cursor(disease, email):
+    doc = users_collection().find_one({"email": email, "disease": disease}, {"_id": 0, "last_drug": 1})
+    return doc.get("last_drug") if doc else None
+
+
+def save_cursor(disease, email, drug):
+    users_collection().update_one(
+        {"email": email, "disease": disease},
+        {"$set": {"last_drug": drug, "updated_at": utc_now()}},
+        upsert=True
+    )
+
+
+def load_disease_summaries():
+    """Summary of every disease copy with its maintained drug and completed counts."""
+    return list(diseases_collection().find(
+        {},
+        {"_id": 0, "disease": 1, "parent_disease": 1, "annotator": 1, "drug_count": 1, "completed_count": 1}
+    ).sort([("parent_disease", ASCENDING), ("annotator", ASCENDING)]))
+
+
+def load_status_counts(field="Q1.selection"):
+    """{disease: {answer: drugs}} for one answer field, counted by the database.
+
+    Unanswered drugs are counted under None.
+    """
+    pipeline = [
+        {"$group": {"_id": {"disease": "$disease", "value": f"${field}"}, "drugs": {"$sum": 1}}},
+        {"$group": {"_id": "$_id.disease", "values": {"$push": {"value": "$_id.value", "drugs": "$drugs"}}}},
+    ]
+    return {
+        row["_id"]: {entry.get("value"): entry["drugs"] for entry in row["values"]}
+        for row in annotations_collection().aggregate(pipeline)
+    }
+
+
+def save_references(ref_docs):
+    """Insert shared reference documents that are not stored yet.
+
+    Reference ids include a hash of their content, so a stored document
+    never needs updating.
+    """
+    requests = [
+        UpdateOne({"_id": doc["_id"]}, {"$setOnInsert": doc}, upsert=True)
+        for doc in ref_docs
+    ]
+    if not requests:
+        return
+    try:
+        references_collection().bulk_write(requests, ordered=False)
+    except BulkWriteError as exc:
+        # diseases ingested in parallel upsert the same reference at once;
+        # the loser's duplicate key error means the document is already there
+        details = exc.details
+        if details.get("writeConcernErrors") or any(
+            error.get("code") != 11000 for error in details.get("writeErrors", [])
+        ):
+            raise
+
+
+def load_references(ids):
+    """Rendered markdown of the given references in one query."""
+    return references_collection().find({"_id": {"$in": list(ids)}}, {"md": 1})
@@ -0,0 +1,386 @@
+import json
+import sqlite3
+import threading
+
+import streamlit as st
+
+from store import ANSWER_FIELDS, PREFILLED_ANSWERS, drug_doc, get_dotted, set_dotted, utc_now
+
+# embedded storage backend: one local SQLite file, no server needed.
+# Drug documents are kept whole as JSON; the columns beside them are the
+# fields that are filtered or sorted on, indexed like the Mongo collections.
+SQLITE_DEFAULTS = {
+    "SQLITE_PATH": "kgxllm.sqlite3",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    disease TEXT NOT NULL,
+    drug TEXT NOT NULL,
+    ord INTEGER,
+    parent_disease TEXT,
+    annotator TEXT,
+    completed INTEGER NOT NULL DEFAULT 0,
+    source_hash TEXT,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (disease, drug)
+);
+CREATE INDEX IF NOT EXISTS annotations_order ON annotations (disease, ord);
+CREATE INDEX IF NOT EXISTS annotations_pending ON annotations (disease, completed, ord);
+CREATE INDEX IF NOT EXISTS annotations_copies ON annotations (parent_disease, annotator, drug);
+
+CREATE TABLE IF NOT EXISTS diseases (
+    disease TEXT PRIMARY KEY,
+    parent_disease TEXT,
+    annotator TEXT,
+    drug_count INTEGER NOT NULL DEFAULT 0,
+    completed_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT NOT NULL,
+    disease TEXT NOT NULL,
+    last_drug TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (email, disease)
+);
+
+CREATE TABLE IF NOT EXISTS refs (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    ref TEXT,
+    md TEXT
+);
+"""
+
+# SQLite variables per statement stay well under the compile-time limit
+IN_CHUNK = 500
+
+_lock = threading.RLock()
+_connections = {}
+
+
+def sqlite_path():
+    return st.secrets.get("SQLITE_PATH", SQLITE_DEFAULTS["SQLITE_PATH"])
+
+
+def connection():
+    """One connection per database file, shared by every thread under _lock.
+
+    Streamlit runs each rerun on a fresh thread, so per-thread connections
+    would be reopened constantly; the writes here are short enough that a
+    single serialized connection is faster.
+    """
+    path = sqlite_path()
+    with _lock:
+        conn = _connections.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            _connections[path] = conn
+        return conn
+
+
+def is_transient_error(exc):
+    # another process holds the write lock past the busy timeout
+    # (extended result codes keep the primary code in the low byte)
+    code = getattr(exc, "sqlite_errorcode", 0) & 0xFF
+    return isinstance(exc, sqlite3.OperationalError) and code in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def warm_up():
+    connection()
+
+
+def ensure_indexes():
+    # created with the schema when the file is opened
+    connection()
+
+
+def _replace(conn, doc):
+    conn.execute(
+        "INSERT OR REPLACE INTO annotations"
+        " (disease, drug, ord, parent_disease, annotator, completed, source_hash, doc)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            doc["disease"], doc["drug"], doc.get("order"), doc.get("parent_disease"),
+            doc.get("annotator"), int(bool(doc.get("completed"))), doc.get("source_hash"),
+            json.dumps(doc, ensure_ascii=False),
+        )
+    )
+
+
+def _load(conn, disease, drug):
+    row = conn.execute(
+        "SELECT doc FROM annotations WHERE disease = ? AND drug = ?", (disease, drug)
+    ).fetchone()
+    return json.loads(row["doc"]) if row else None
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK):
+        yield values[start:start + IN_CHUNK]
+
+
+def write_drugs(copies, batch):
+    conn = connection()
+    with _lock, conn:
+        for disease, parent_disease, annotator in copies:
+            for order, record, source_hash in batch:
+                _replace(conn, drug_doc(disease, record, order, parent_disease, annotator, source_hash))
+
+
+def load_fingerprints(disease):
+    with _lock:
+        rows = connection().execute(
+            "SELECT drug, source_hash, ord FROM annotations WHERE disease = ?", (disease,)
+        ).fetchall()
+    return {row["drug"]: {"drug": row["drug"], "source_hash": row["source_hash"], "order": row["ord"]} for row in rows}
+
+
+def sync_drugs(copies, batch, existing):
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    conn = connection()
+    with _lock, conn:
+        for disease, parent_disease, annotator in copies:
+            stored = existing.get(disease, {})
+            for order, record, source_hash in batch:
+                drug = record.get("drug")
+                current = stored.get(drug)
+                if current is None:
+                    counts["new"] += 1
+                    _replace(conn, drug_doc(disease, record, order, parent_disease, annotator, source_hash))
+                elif current.get("source_hash") != source_hash:
+                    counts["changed"] += 1
+                    old = _load(conn, disease, drug) or {}
+                    doc = drug_doc(disease, record, order, parent_disease, annotator, source_hash)
+                    for field in ANSWER_FIELDS:
+                        value, found = get_dotted(old, field)
+                        if not found:
+                            continue
+                        if field in PREFILLED_ANSWERS and not old.get("completed"):
+                            # still the pipeline value it was last ingested with: take the new one
+                            previous, known = get_dotted(old.get("prefill") or {}, field)
+                            if known and value == previous and get_dotted(doc, field)[1]:
+                                continue
+                        set_dotted(doc, field, value)
+                    _replace(conn, doc)
+                else:
+                    counts["unchanged"] += 1
+                    if current.get("order") != order:
+                        conn.execute(
+                            "UPDATE annotations SET ord = ?, doc = json_set(doc, '$.order', ?)"
+                            " WHERE disease = ? AND drug = ?",
+                            (order, order, disease, drug)
+                        )
+    return counts
+
+
+def finish_disease(disease, drugs, parent_disease=None, annotator=None, prune=True):
+    conn = connection()
+    with _lock, conn:
+        if prune:
+            keep = set(drugs)
+            stored = [row["drug"] for row in conn.execute(
+                "SELECT drug FROM annotations WHERE disease = ?", (disease,)
+            )]
+            conn.executemany(
+                "DELETE FROM annotations WHERE disease = ? AND drug = ?",
+                [(disease, drug) for drug in stored if drug not in keep]
+            )
+        drug_count, completed_count = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(completed), 0) FROM annotations WHERE disease = ?", (disease,)
+        ).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO diseases (disease, parent_disease, annotator, drug_count, completed_count)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (disease, parent_disease or disease, annotator, drug_count, completed_count)
+        )
+
+
+def load_drug_index(disease):
+    with _lock:
+        rows = connection().execute(
+            "SELECT drug, ord, completed, json_extract(doc, '$.Q1.selection') AS q1"
+            " FROM annotations WHERE disease = ? ORDER BY ord",
+            (disease,)
+        ).fetchall()
+    return [
+        {"drug": row["drug"], "order": row["ord"], "completed": bool(row["completed"]), "Q1": {"selection": row["q1"]}}
+        for row in rows
+    ]
+
+
+def iter_annotations(parent_diseases=None, annotators=None, projection=None, batch_size=1000):
+    """Whole documents in (disease, order) order, read batch_size at a time.
+
+    projection is accepted for interface compatibility; documents are
+    always returned whole.
+    """
+    where = []
+    params = []
+    if parent_diseases:
+        where.append(f"parent_disease IN ({', '.join('?' * len(parent_diseases))})")
+        params.extend(parent_diseases)
+    if annotators:
+        where.append(f"annotator IN ({', '.join('?' * len(annotators))})")
+        params.extend(annotators)
+    # keyset paging, so the lock is only held for one batch at a time
+    last = ("", -1)
+    while True:
+        clauses = where + ["(disease, ord) > (?, ?)"]
+        with _lock:
+            rows = connection().execute(
+                f"SELECT disease, ord, doc FROM annotations WHERE {' AND '.join(clauses)}"
+                " ORDER BY disease, ord LIMIT ?",
+                (*params, *last, batch_size)
+            ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield json.loads(row["doc"])
+        last = (rows[-1]["disease"], rows[-1]["ord"])
+
+
+def load_drug(disease, drug):
+    with _lock:
+        return _load(connection(), disease, drug)
+
+
+def load_answers(disease, drug):
+    # the whole document is one local read; store picks the answers out
+    return load_drug(disease, drug)
+
+
+def _set_completed(conn, disease, drug, completed):
+    changed = conn.execute(
+        "UPDATE annotations SET completed = ?, doc = json_set(doc, '$.completed', json(?))"
+        " WHERE disease = ? AND drug = ? AND completed != ?",
+        (int(completed), "true" if completed else "false", disease, drug, int(completed))
+    ).rowcount
+    if changed:
+        conn.execute(
+            "UPDATE diseases SET completed_count = completed_count + ? WHERE disease = ?",
+            (1 if completed else -1, disease)
+        )
+    return bool(changed)
+
+
+def set_completed(disease, drug, completed=True):
+    """Flip the flag and the counter in one transaction."""
+    conn = connection()
+    with _lock, conn:
+        return _set_completed(conn, disease, drug, completed)
+
+
+def _write_answers(conn, disease, drug, fields, version, owner):
+    """Version-checked write of answer fields; returns False if it was rejected."""
+    doc = _load(conn, disease, drug)
+    if doc is None:
+        # a drug that no longer exists has nothing to conflict with
+        return True
+    if version is not None and doc.get("version", 0) != version and doc.get("updated_by") != owner:
+        return False
+    for key, value in fields.items():
+        set_dotted(doc, key, value)
+    doc.update({"version": doc.get("version", 0) + 1, "updated_at": utc_now(), "updated_by": owner})
+    _replace(conn, doc)
+    return True
+
+
+def bulk_set_drug_fields(updates):
+    """Apply every update in a single transaction; returns the rejected ones."""
+    conflicts = []
+    conn = connection()
+    with _lock, conn:
+        for disease, drug, fields, version, owner in updates:
+            fields = dict(fields)
+            completed = fields.pop("completed", None)
+            if fields and not _write_answers(conn, disease, drug, fields, version, owner):
+                conflicts.append((disease, drug, owner))
+            if completed is not None:
+                _set_completed(conn, disease, drug, completed)
+    return conflicts
+
+
+def next_pending(disease, after_order=-1):
+    with _lock:
+        conn = connection()
+        for lower in dict.fromkeys((after_order, -1)):
+            row = conn.execute(
+                "SELECT drug, ord FROM annotations WHERE disease = ? AND completed = 0 AND ord > ?"
+                " ORDER BY ord LIMIT 1",
+                (disease, lower)
+            ).fetchone()
+            if row:
+                return {"drug": row["drug"], "order": row["ord"]}
+    return None
+
+
+def load_cursor(disease, email):
+    with _lock:
+        row = connection().execute(
+            "SELECT last_drug FROM users WHERE email = ? AND disease = ?", (email, disease)
+        ).fetchone()
+    return row["last_drug"] if row else None
+
+
+def save_cursor(disease, email, drug):
+    conn = connection()
+    with _lock, conn:
+        conn.execute(
+            "INSERT INTO users (email, disease, last_drug, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (email, disease) DO UPDATE SET last_drug = excluded.last_drug,"
+            " updated_at = excluded.updated_at",
+            (email, disease, drug, utc_now())
+        )
+
+
+def load_disease_summaries():
+    with _lock:
+        rows = connection().execute(
+            "SELECT disease, parent_disease, annotator, drug_count, completed_count"
+            " FROM diseases ORDER BY parent_disease, annotator"
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def load_status_counts(field="Q1.selection"):
+    counts = {}
+    with _lock:
+        rows = connection().execute(
+            "SELECT disease, json_extract(doc, ?) AS value, COUNT(*) AS drugs"
+            " FROM annotations GROUP BY disease, value",
+            (f"$.{field}",)
+        ).fetchall()
+    for row in rows:
+        counts.setdefault(row["disease"], {})[row["value"]] = row["drugs"]
+    return counts
+
+
+def save_references(ref_docs):
+    conn = connection()
+    with _lock, conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO refs (id, kind, ref, md) VALUES (?, ?, ?, ?)",
+            [
+                (doc["_id"], doc.get("kind"), json.dumps(doc.get("ref"), ensure_ascii=False), doc.get("md"))
+                for doc in ref_docs
+            ]
+        )
+
+
+def load_references(ids):
+    found = []
+    with _lock:
+        conn = connection()
+        for chunk in _chunks(dict.fromkeys(ids)):
+            rows = conn.execute(
+                f"SELECT id, md FROM refs WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.extend({"_id": row["id"], "md": row["md"]} for row in rows)
+    return found